@@ -0,0 +1,233 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+# Statuses that mean "not now" rather than "not this batch"
+RETRY_STATUSES = {408, 429}
+# Statuses that mean the batch itself is malformed
+REFUSED_STATUSES = {400, 422}
+MAX_RETRY_AFTER = 3600  # seconds
+
+
+class ServerUnavailable(Exception):
+    """The API answered, but can't take readings right now."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def retry_after(response):
+    """Seconds to wait from a Retry-After header (delay or HTTP date), or None."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+class Forwarder:
+    """
+    Forwards sensor readings to the web API from a background thread.
+
+    The MQTT callback only appends readings to the spool, so a slow or
+    unreachable API never blocks paho's network loop (and therefore never
+    starves MQTT keepalives). All HTTP requests go through a single
+    requests.Session, which keeps TCP/TLS connections to the API alive
+    between readings.
+
+    Readings are sent to the batch endpoint in groups of up to
+    `batch_size`, flushed at the latest `flush_interval` seconds after the
+    first reading of a batch was spooled. A batch stays in the spool until
+    the API accepts it. Outages (network errors, 5xx, 408 and 429, and any
+    other unexpected answer) are retried as a whole batch with exponential
+    backoff, honouring Retry-After, for as long as they last; sending is
+    capped at `replay_rate` readings per second so draining a backlog
+    afterwards doesn't stampede the database. Devices in `known_devices`
+    are not re-registered before each batch, and a batch is not sent
+    until all of its devices are.
+
+    Only readings the API says are malformed are given up on, so they
+    can't block the spool head forever: a batch refused with 400/422 is
+    split and its readings resent one by one, and a single refused
+    reading, or one marked invalid in the batch results, is moved to the
+    spool's dead-letter table.
+    """
+
+    def __init__(self, batch_url, reg_url, known_devices, spool, pool_size=4, timeout=10,
+                 batch_size=100, flush_interval=1.0, replay_rate=200.0,
+                 min_backoff=1.0, max_backoff=60.0):
+        self.batch_url = batch_url
+        self.reg_url = reg_url
+        self.known_devices = known_devices
+        self.spool = spool
+        self.timeout = timeout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.replay_rate = replay_rate
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self.stats = {"sent": 0, "rejected": 0, "failed_batches": 0, "batches": 0, "split_batches": 0}
+        self._tokens = float(max(replay_rate, batch_size))
+        self._last_refill = time.time()
+        self._split_until = None  # send readings one by one up to this spool seq
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="forwarder", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the worker; anything not yet sent stays in the spool for next time."""
+        self._stop.set()
+        self._thread.join(timeout=timeout)
+        self.session.close()
+
+    def submit(self, reading):
+        """Spool a reading for forwarding."""
+        return self.spool.put(reading)
+
+    def _throttle_replay(self, count):
+        """Token bucket: wait until `count` readings may be sent."""
+        if self.replay_rate <= 0:
+            return
+        capacity = max(self.replay_rate, self.batch_size)
+        now = time.time()
+        self._tokens = min(capacity, self._tokens + (now - self._last_refill) * self.replay_rate)
+        self._last_refill = now
+        if self._tokens < count:
+            self._stop.wait((count - self._tokens) / self.replay_rate)
+            self._tokens = count
+            self._last_refill = time.time()
+        self._tokens -= count
+
+    def _run(self):
+        backoff = self.min_backoff
+        while not self._stop.is_set():
+            batch = self.spool.get_batch(self.batch_size, self.flush_interval)
+            if not batch:
+                continue
+            if self._split_until is not None:
+                if batch[0][0] <= self._split_until:
+                    batch = batch[:1]
+                else:
+                    self._split_until = None
+
+            self._throttle_replay(len(batch))
+            try:
+                refused = not self._forward(batch)
+            except (requests.RequestException, ServerUnavailable) as e:
+                # An outage says nothing about the batch: keep it and wait
+                print(f"[ERROR] Failed to reach server: {e}")
+                wait = backoff
+                if getattr(e, "retry_after", None) is not None:
+                    wait = max(wait, e.retry_after)
+                self.stats["failed_batches"] += 1
+                print(f"Retrying in {wait:.1f}s ({len(self.spool)} readings spooled)")
+                self._stop.wait(wait)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            backoff = self.min_backoff
+            if not refused:
+                continue
+            if len(batch) > 1:
+                self._split_until = batch[-1][0]
+                self.stats["split_batches"] += 1
+                print(f"[ERROR] Server refused a batch of {len(batch)} readings, sending them one by one")
+            else:
+                self.stats["rejected"] += 1
+                self.spool.dead_letter([batch[0][0]], "refused by server")
+                print(f"[ERROR] Dead-lettered reading: {batch[0][1]}")
+
+    def _check(self, response, what):
+        """Raise ServerUnavailable unless `response` is a 2xx or a 400/422 refusal."""
+        if 200 <= response.status_code < 300 or response.status_code in REFUSED_STATUSES:
+            return
+        if response.status_code >= 500 or response.status_code in RETRY_STATUSES:
+            raise ServerUnavailable(f"{what}: {response.status_code}", retry_after(response))
+        # Anything else (401, 403, 404, ...) is a configuration problem, not a bad batch
+        raise ServerUnavailable(f"{what}: unexpected {response.status_code} {response.text[:200]}",
+                                retry_after(response))
+
+    def _register(self, mac_address):
+        """
+        Register a device with the API unless we already know it is registered.
+
+        Returns False if the API refused the device (400/422); raises
+        ServerUnavailable if registration should be retried later, so the
+        device's readings are not sent before it exists.
+        """
+        if self.known_devices.is_known(mac_address):
+            return True
+        regResponse = self.session.post(self.reg_url, json={"mac_address": mac_address}, timeout=self.timeout)
+        self._check(regResponse, f"Failed to register {mac_address}")
+        if regResponse.status_code in REFUSED_STATUSES:
+            print(f"[ERROR] Server refused to register {mac_address}: {regResponse.status_code}")
+            return False
+        self.known_devices.add(mac_address)
+        print(f"mac_address: {mac_address}")
+        return True
+
+    def _forward(self, batch):
+        """
+        Send one batch of (seq, reading) pairs and ack what the API handled.
+
+        Returns False if the API refused the batch as malformed (400/422).
+        Network errors and outages are raised.
+        """
+        readings = [reading for _, reading in batch]
+        for mac_address in {reading["mac_address"] for reading in readings}:
+            if not self._register(mac_address):
+                return False
+
+        response = self.session.post(self.batch_url, json=readings, timeout=self.timeout)
+        self._check(response, "Failed to send data to server")
+        if response.status_code in REFUSED_STATUSES:
+            print(f"[ERROR] Server refused batch: {response.status_code} {response.text[:200]}")
+            return False
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        if not isinstance(body, dict) or len(body.get("results") or []) != len(batch):
+            raise ServerUnavailable(f"Unexpected reply from server: {response.status_code} {response.text[:200]}")
+
+        self.stats["batches"] += 1
+        self.stats["sent"] += body["inserted"]
+        done = []
+        kept = 0
+        for (seq, reading), result in zip(batch, body["results"]):
+            if result["status"] == "inserted":
+                done.append(seq)
+            elif result["status"] == "invalid":
+                self.stats["rejected"] += 1
+                print(f"[ERROR] Server rejected reading from {reading['mac_address']}: {result.get('error')}")
+                self.spool.dead_letter([seq], result.get("error") or "invalid")
+            else:
+                # Most likely the device was deleted on the server: keep the
+                # reading and re-register the device before the next attempt
+                self.known_devices.forget(reading["mac_address"])
+                kept += 1
+        self.spool.ack(done)
+        print(f"Sent {body['inserted']}/{len(batch)} readings")
+        if kept:
+            raise ServerUnavailable(f"{kept} readings from unregistered devices kept for retry")
+        return True
@@ -1,103 +1,332 @@
 import paho.mqtt.client as mqtt
 import json
+import math
 from datetime import datetime
-from collections import deque
 import os
 from dotenv import load_dotenv
-import numpy as np
-import requests
 import time
+import re
+import zlib
+import signal
+import sys
+import argparse
+import queue
+import multiprocessing as mp
+
+from forwarder import Forwarder
+from registry import KnownDevices
+from throttle import DeviceThrottle
+from spool import Spool
 
 load_dotenv()
 url = "http://final-project-josephg-jonathank.onrender.com/api/temperature"
+batch_url = url + "/batch"
 reg_url = "http://final-project-josephg-jonathank.onrender.com/api/register_device/"
 BROKER = "broker.emqx.io"
 PORT = 1883
 BASE_TOPIC = os.getenv("BASE_TOPIC")
 TOPIC = BASE_TOPIC + "/#"
+SHARE_GROUP = os.getenv("SHARE_GROUP", "bridge")
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", "10"))
 
-last_sent_time = 0
+# Cheap way to find the device of a raw payload without a full JSON decode
+MAC_PATTERN = re.compile(rb'"mac_address"\s*:\s*"([^"]*)"')
 
-def on_connect(client, userdata, flags, reason_code, properties):
-    """Callback for when the client connects to the broker."""
-    if reason_code == 0:
-        print("Successfully connected to MQTT broker")
-        client.subscribe(TOPIC)
-        print(f"Subscribed to {TOPIC}")
-    else:
-        print(f"Failed to connect with result code {reason_code}")
 
+def shard_of(mac_address, num_workers):
+    """Stable (across processes and restarts) worker index for a device."""
+    return zlib.crc32(mac_address) % num_workers
 
-def on_message(client, userdata, message):
-    global last_sent_time
-    now = time.time()
 
-    try:
-        payload = json.loads(message.payload.decode())
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        mac_address = payload["mac_address"]
-        temperature = payload["temperature"]
+class BridgeWorker:
+    """
+    One MQTT consumer: throttle -> spool -> forwarder for its share of the devices.
+
+    With several workers, each one either subscribes through an MQTT
+    shared subscription (the broker load-balances messages) or receives
+    every message and only keeps the devices that hash to it, which keeps
+    each device on a single worker so its throttle window and ordering
+    stay intact.
+    """
+
+    def __init__(self, worker_id=0, num_workers=1, shard_mode="hash"):
+        self.worker_id = worker_id
+        self.num_workers = num_workers
+        self.shard_mode = shard_mode
+        # Each worker keeps its own files when running sharded
+        suffix = f"-{worker_id}" if num_workers > 1 else ""
+
+        # At most one reading per device per interval, chosen by the throttle policy
+        self.throttle = DeviceThrottle(
+            interval=float(os.getenv("THROTTLE_INTERVAL", "5")),
+            policy=os.getenv("THROTTLE_POLICY", "last"),
+        )
+
+        # MAC addresses already registered with the API, kept across restarts
+        self.known_devices = KnownDevices(os.getenv("KNOWN_DEVICES_FILE", "known_devices") + f"{suffix}.json")
+
+        # Readings wait here (on disk) until the API has accepted them
+        self.spool = Spool(os.getenv("SPOOL_PATH", "spool") + f"{suffix}.db",
+                           max_rows=int(os.getenv("SPOOL_MAX_ROWS", "100000")))
+
+        # HTTP forwarding runs on its own thread so on_message never waits on the API
+        self.forwarder = Forwarder(batch_url, reg_url, self.known_devices, self.spool,
+                                   replay_rate=float(os.getenv("REPLAY_RATE", "200")),
+                                   batch_size=int(os.getenv("BATCH_SIZE", "100")),
+                                   flush_interval=float(os.getenv("BATCH_FLUSH_INTERVAL", "1")))
+
+        self.received = 0
+        self.skipped = 0
+
+    def topic(self):
+        if self.num_workers > 1 and self.shard_mode == "shared":
+            return f"$share/{SHARE_GROUP}/{TOPIC}"
+        return TOPIC
 
-        if not mac_address:
-            print(f"[ERROR] MAC address is missing in the payload: {payload}")
+    def owns(self, payload):
+        """In hash mode, whether this worker is responsible for a raw payload."""
+        if self.num_workers <= 1 or self.shard_mode != "hash":
+            return True
+        match = MAC_PATTERN.search(payload)
+        if not match:
+            # Malformed messages are logged once, by worker 0
+            return self.worker_id == 0
+        return shard_of(match.group(1), self.num_workers) == self.worker_id
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        """Callback for when the client connects to the broker."""
+        if reason_code == 0:
+            print("Successfully connected to MQTT broker")
+            # The ESP32s publish at QoS 0 and we connect with a fresh clean
+            # session, so the broker never redelivers: readings published
+            # while the bridge is down, or not yet spooled when it dies, are
+            # lost. Durability only starts at the spool.
+            client.subscribe(self.topic(), qos=0)
+            print(f"Subscribed to {self.topic()}")
+        else:
+            print(f"Failed to connect with result code {reason_code}")
+
+    def on_message(self, client, userdata, message):
+        now = time.time()
+
+        if not self.owns(message.payload):
+            self.skipped += 1
             return
+        self.received += 1
+
+        # Anything raised here would kill paho's network thread (loop_start)
+        # and silently stop consumption, so bad messages are logged and dropped
+        try:
+            payload = json.loads(message.payload.decode())
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            mac_address = payload.get("mac_address")
+            temperature = payload.get("temperature")
+
+            if not mac_address:
+                print(f"[ERROR] MAC address is missing in the payload: {payload}")
+                return
+
+            if temperature is None:
+                print(f"[ERROR] Temperature is missing in the payload: {payload}")
+                return
+
+            # The throttle sums values, so only finite numbers may reach it
+            try:
+                if isinstance(temperature, bool):
+                    raise ValueError
+                value = float(temperature)
+            except (TypeError, ValueError):
+                value = math.nan
+            if not math.isfinite(value):
+                print(f"[ERROR] Temperature is not a number in the payload: {payload}")
+                return
 
-        if "temperature" in payload and now - last_sent_time >= 5:
             temperature_data = {
                 "mac_address": mac_address,
-                "value": temperature,
+                "value": value,
                 "unit": "Celsius",
                 "timestamp": timestamp
             }
-            print(temperature_data)
-            regResponse = requests.post(reg_url, json={"mac_address": payload["mac_address"]})
-            if regResponse.status_code == 200:
-                print(f"mac_address: {payload['mac_address']}")
-            else:
-                print(f"[ERROR] Failed to send data to server: {regResponse.status_code}")
+            for reading in self.throttle.offer(temperature_data, now):
+                self.forwarder.submit(reading)
 
-            response = requests.post(url, json=temperature_data)
-            
-            if response.status_code == 200:
-                print(f"[{timestamp}] Sent temperature: {payload['temperature']}°C")
-            else:
-                print(f"[ERROR] Failed to send data to server: {response.status_code}")
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            print(f"[ERROR] Received non-JSON message on {message.topic}: {message.payload!r}")
+        except AttributeError:
+            # Valid JSON, but not an object (e.g. a bare number or list)
+            print(f"[ERROR] Received non-object message on {message.topic}: {message.payload!r}")
+        except Exception as e:
+            print(f"[ERROR] Failed to handle message on {message.topic}: {e!r} {message.payload!r}")
 
-            last_sent_time = now
+    def stats(self):
+        return {
+            "worker": self.worker_id,
+            "received": self.received,
+            "skipped": self.skipped,
+            "sent": self.forwarder.stats["sent"],
+            "rejected": self.forwarder.stats["rejected"],
+            "dead_lettered": self.spool.stats["dead_lettered"],
+            "backlog": len(self.spool),
+            "lag": self.spool.oldest_age(),
+            "registrations_avoided": self.known_devices.avoided,
+        }
 
-    except json.JSONDecodeError:
-        print(f"[ERROR] Received non-JSON message on {message.topic}: {message.payload.decode()}")
+    def run(self, stats_queue=None):
+        # Create MQTT client
+        print("Creating MQTT client...")
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
 
+        # Set callback functions
+        print("Setting callback functions...")
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
 
-def main():
-    # Create MQTT client
-    print("Creating MQTT client...")
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self.forwarder.start()
 
-    # Set callback functions
-    client.on_connect = on_connect
-    client.on_message = on_message
+        try:
+            # Connect to broker
+            print("Connecting to broker...")
+            client.connect(BROKER, PORT, 60)
 
+            # Start the MQTT loop
+            print("Starting MQTT loop...")
+            client.loop_start()
 
-    # Set the callback functions onConnect and onMessage
-    print("Setting callback functions...")
-    
-    try:
-        # Connect to broker
-        print("Connecting to broker...")
-        client.connect(BROKER, PORT, 60)
-        
-        # Start the MQTT loop
-        print("Starting MQTT loop...")
-        client.loop_forever()    
+            # Flush throttle windows of devices that went quiet, report stats
+            next_report = time.time() + STATS_INTERVAL
+            while True:
+                time.sleep(0.5)
+                if not network_thread_alive(client):
+                    # Nothing is consuming any more; exit so the supervisor
+                    # (or the container runtime) starts a fresh worker
+                    print("[ERROR] MQTT network thread died, exiting")
+                    self.shutdown(client)
+                    sys.exit(1)
+                for reading in self.throttle.drain(time.time()):
+                    self.forwarder.submit(reading)
+                if stats_queue is not None and time.time() >= next_report:
+                    stats_queue.put(self.stats())
+                    next_report = time.time() + STATS_INTERVAL
 
-    except KeyboardInterrupt:
-        print("\nDisconnecting from broker...")
+        except KeyboardInterrupt:
+            print("\nDisconnecting from broker...")
+            self.shutdown(client)
+            print(f"Registration calls avoided: {self.known_devices.avoided}")
+            print("Exited successfully")
+        except Exception as e:
+            print(f"Error: {e}")
+            self.shutdown(client)
+            sys.exit(1)
+
+    def shutdown(self, client):
+        """Stop MQTT, flush throttled readings to the spool and stop forwarding."""
         # make sure to stop the loop and disconnect from the broker
         client.disconnect()
+        client.loop_stop()
+        try:
+            for reading in self.throttle.drain(time.time(), force=True):
+                self.forwarder.submit(reading)
+        finally:
+            self.forwarder.stop()
+            self.spool.close()
+
+
+def network_thread_alive(client):
+    """Whether the thread started by loop_start() is still running."""
+    # paho clears _thread when its loop exits, including on a callback exception
+    thread = getattr(client, "_thread", None)
+    return thread is not None and thread.is_alive()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_worker(worker_id, num_workers, shard_mode, stats_queue):
+    """Entry point of a worker process."""
+    # The supervisor stops workers with SIGTERM; shut down the same way as Ctrl+C
+    signal.signal(signal.SIGTERM, _interrupt)
+    BridgeWorker(worker_id, num_workers, shard_mode).run(stats_queue)
+
+
+def supervise(num_workers, shard_mode):
+    """
+    Run num_workers bridge processes, restart any that die, and print
+    fleet-wide throughput and lag every STATS_INTERVAL seconds.
+    """
+    stats_queue = mp.Queue()
+    processes = {}
+    restarts = 0
+    latest = {}  # worker id -> last stats report
+    previous_sent = 0
+    last_report = time.time()
+
+    def spawn(worker_id):
+        process = mp.Process(target=run_worker, args=(worker_id, num_workers, shard_mode, stats_queue),
+                             name=f"bridge-{worker_id}", daemon=True)
+        process.start()
+        processes[worker_id] = process
+        print(f"Started worker {worker_id} (pid {process.pid})")
+
+    for worker_id in range(num_workers):
+        spawn(worker_id)
+
+    try:
+        while True:
+            time.sleep(1)
+
+            for worker_id, process in list(processes.items()):
+                if not process.is_alive():
+                    restarts += 1
+                    print(f"[ERROR] Worker {worker_id} exited with code {process.exitcode}, restarting")
+                    spawn(worker_id)
+
+            while True:
+                try:
+                    report = stats_queue.get_nowait()
+                except queue.Empty:
+                    break
+                latest[report["worker"]] = report
+
+            now = time.time()
+            if latest and now - last_report >= STATS_INTERVAL:
+                sent = sum(report["sent"] for report in latest.values())
+                # A restarted worker starts counting from zero again
+                rate = max(0, sent - previous_sent) / (now - last_report)
+                print(
+                    f"[stats] workers={len(processes)} restarts={restarts} "
+                    f"received={sum(report['received'] for report in latest.values())} "
+                    f"sent={sent} ({rate:.1f}/s) "
+                    f"backlog={sum(report['backlog'] for report in latest.values())} "
+                    f"dead_lettered={sum(report['dead_lettered'] for report in latest.values())} "
+                    f"max_lag={max(report['lag'] for report in latest.values()):.1f}s "
+                    f"registrations_avoided={sum(report['registrations_avoided'] for report in latest.values())}"
+                )
+                previous_sent = sent
+                last_report = now
+
+    except KeyboardInterrupt:
+        print("\nStopping workers...")
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+        for process in processes.values():
+            process.join(timeout=10)
         print("Exited successfully")
-    except Exception as e:
-        print(f"Error: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forward ESP32 readings from MQTT to the web API.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("BRIDGE_WORKERS", "1")),
+                        help="number of consumer processes")
+    parser.add_argument("--shard-mode", choices=["hash", "shared"], default=os.getenv("SHARD_MODE", "hash"),
+                        help="hash: split devices by MAC across workers; shared: MQTT shared subscription")
+    args = parser.parse_args()
+
+    if args.workers <= 1:
+        BridgeWorker().run()
+    else:
+        supervise(args.workers, args.shard_mode)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
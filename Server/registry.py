@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+
+
+class KnownDevices:
+    """
+    Set of MAC addresses the web API already has registered.
+
+    The set is loaded from a JSON file at startup and written back (via a
+    temp file + rename, so a crash never leaves it half-written) whenever
+    a new device is registered. `avoided` counts registration calls that
+    were skipped because the device was already known.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.avoided = 0
+        self.registered = 0
+        self._lock = threading.Lock()
+        self._macs = set()
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                self._macs = set(json.load(f))
+            print(f"Loaded {len(self._macs)} known devices from {self.path}")
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Could not read known devices from {self.path}: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(sorted(self._macs), f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[ERROR] Could not save known devices to {self.path}: {e}")
+
+    def is_known(self, mac_address):
+        """Check a MAC address, counting the registration call this saves."""
+        with self._lock:
+            if mac_address in self._macs:
+                self.avoided += 1
+                return True
+            return False
+
+    def add(self, mac_address):
+        with self._lock:
+            if mac_address in self._macs:
+                return
+            self._macs.add(mac_address)
+            self.registered += 1
+            self._save()
+
+    def forget(self, mac_address):
+        """Drop a device, e.g. after the API rejected its reading, so it is registered again."""
+        with self._lock:
+            if mac_address not in self._macs:
+                return
+            self._macs.discard(mac_address)
+            self._save()
+
+    def __len__(self):
+        return len(self._macs)
+
+    def stats(self):
+        return {"known": len(self._macs), "registered": self.registered, "avoided": self.avoided}
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+class Spool:
+    """
+    Durable FIFO of readings waiting to be forwarded, stored in SQLite (WAL mode).
+
+    Readings are appended with a monotonically increasing sequence number
+    and only removed once the API has accepted them (ack), so nothing is
+    lost while the API is down or the bridge restarts, and readings for a
+    device are always forwarded in the order they arrived. At most
+    `max_rows` readings are kept; past that the oldest are discarded,
+    which bounds disk usage during long outages. Use ":memory:" as the
+    path for a non-durable spool.
+
+    Readings the API will never accept are moved to a separate
+    dead_letter table (with the reason) instead of being deleted, so they
+    can be inspected or replayed by hand.
+    """
+
+    def __init__(self, path, max_rows=100000):
+        self.path = path
+        self.max_rows = max_rows
+        self.stats = {"spooled": 0, "acked": 0, "overflowed": 0, "dead_lettered": 0}
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                reading TEXT NOT NULL,
+                queued_at REAL NOT NULL
+            )
+        """)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                seq INTEGER PRIMARY KEY,
+                reading TEXT NOT NULL,
+                queued_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                reason TEXT
+            )
+        """)
+        self._lock = threading.Condition()
+        self._count = self._db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        if self._count:
+            print(f"Spool {path} has {self._count} readings left from a previous run")
+
+    def put(self, reading):
+        """Append a reading, discarding the oldest ones if the spool is full."""
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO spool (reading, queued_at) VALUES (?, ?)",
+                (json.dumps(reading), time.time())
+            )
+            self._count += 1
+            self.stats["spooled"] += 1
+            overflow = self._count - self.max_rows
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM spool WHERE seq IN (SELECT seq FROM spool ORDER BY seq LIMIT ?)",
+                    (overflow,)
+                )
+                self._count -= overflow
+                self.stats["overflowed"] += overflow
+                print(f"[ERROR] Spool full, discarded {overflow} oldest readings")
+            self._lock.notify()
+        return True
+
+    def get_batch(self, max_items, linger, timeout=0.5):
+        """
+        Return up to max_items (seq, reading) pairs from the head of the spool.
+
+        Waits up to `timeout` for the first reading, then up to `linger`
+        more seconds for the batch to fill. Returned readings stay in the
+        spool until they are acked.
+        """
+        with self._lock:
+            if not self._lock.wait_for(lambda: self._count > 0, timeout):
+                return []
+            if self._count < max_items:
+                self._lock.wait_for(lambda: self._count >= max_items, linger)
+            rows = self._db.execute(
+                "SELECT seq, reading FROM spool ORDER BY seq LIMIT ?", (max_items,)
+            ).fetchall()
+        return [(seq, json.loads(reading)) for seq, reading in rows]
+
+    def ack(self, seqs):
+        """Remove readings the API has accepted (or permanently rejected)."""
+        if not seqs:
+            return
+        with self._lock:
+            placeholders = ", ".join("?" * len(seqs))
+            deleted = self._db.execute(f"DELETE FROM spool WHERE seq IN ({placeholders})", seqs).rowcount
+            self._count -= deleted
+            self.stats["acked"] += deleted
+
+    def dead_letter(self, seqs, reason):
+        """Move readings out of the spool into dead_letter, keeping at most max_rows there."""
+        if not seqs:
+            return
+        with self._lock:
+            placeholders = ", ".join("?" * len(seqs))
+            self._db.execute("BEGIN")
+            self._db.execute(
+                f"INSERT OR REPLACE INTO dead_letter (seq, reading, queued_at, failed_at, reason) "
+                f"SELECT seq, reading, queued_at, ?, ? FROM spool WHERE seq IN ({placeholders})",
+                [time.time(), reason, *seqs]
+            )
+            deleted = self._db.execute(f"DELETE FROM spool WHERE seq IN ({placeholders})", seqs).rowcount
+            self._db.execute(
+                "DELETE FROM dead_letter WHERE seq NOT IN (SELECT seq FROM dead_letter ORDER BY seq DESC LIMIT ?)",
+                (self.max_rows,)
+            )
+            self._db.execute("COMMIT")
+            self._count -= deleted
+            self.stats["dead_lettered"] += deleted
+
+    def oldest_age(self):
+        """Seconds the oldest unsent reading has been waiting (0 if empty)."""
+        with self._lock:
+            row = self._db.execute("SELECT MIN(queued_at) FROM spool").fetchone()
+        return time.time() - row[0] if row[0] is not None else 0.0
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        with self._lock:
+            self._db.close()
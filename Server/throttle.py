@@ -0,0 +1,84 @@
+import math
+import threading
+
+
+class DeviceThrottle:
+    """
+    Per-device rate limiting for incoming readings.
+
+    Each MAC address gets its own window of `interval` seconds, opened by
+    its first reading. When the window closes, one reading is emitted for
+    it according to `policy`:
+
+      - "last":    the most recent reading seen in the window
+      - "average": the mean value of all readings in the window, stamped
+                   with the time of the most recent one
+
+    so each device forwards at most one reading per interval no matter
+    how many other devices are publishing.
+    """
+
+    POLICIES = ("last", "average")
+
+    def __init__(self, interval=5.0, policy="last"):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown throttle policy {policy!r}, expected one of {self.POLICIES}")
+        self.interval = interval
+        self.policy = policy
+        self.accepted = 0
+        self.emitted = 0
+        self._windows = {}  # mac_address -> [opened_at, last_reading, value_sum, count]
+        self._lock = threading.Lock()
+
+    def offer(self, reading, now):
+        """
+        Add a reading; returns the readings (0 or 1) whose window it closed.
+
+        The reading's value must be a finite number (ValueError otherwise),
+        so one bad payload can't poison a device's window.
+        """
+        mac_address = reading["mac_address"]
+        value = reading["value"]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"Reading value must be a finite number, got {value!r}")
+        emitted = []
+        with self._lock:
+            self.accepted += 1
+            window = self._windows.get(mac_address)
+            if window is not None and now - window[0] >= self.interval:
+                del self._windows[mac_address]
+                emitted += self._close(mac_address, window)
+                window = None
+            if window is None:
+                self._windows[mac_address] = [now, reading, value, 1]
+            else:
+                window[1] = reading
+                window[2] += value
+                window[3] += 1
+        return emitted
+
+    def drain(self, now, force=False):
+        """Close every window that has expired (or all of them if force)."""
+        emitted = []
+        with self._lock:
+            for mac_address, window in list(self._windows.items()):
+                if force or now - window[0] >= self.interval:
+                    # Removed first, so a window that fails to close can't fail every later drain too
+                    del self._windows[mac_address]
+                    emitted += self._close(mac_address, window)
+        return emitted
+
+    def _close(self, mac_address, window):
+        """The reading a closed window emits, as a list of 0 or 1 (0 if it can't be computed)."""
+        _, reading, value_sum, count = window
+        try:
+            if self.policy == "average":
+                reading = dict(reading, value=round(value_sum / count, 2))
+        except Exception as e:
+            print(f"[ERROR] Dropped throttle window of {mac_address}: {e!r}")
+            return []
+        self.emitted += 1
+        return [reading]
+
+    def stats(self):
+        return {"devices": len(self._windows), "accepted": self.accepted, "emitted": self.emitted}
@@ -0,0 +1,91 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+from typing import Dict
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+
+from .pages import brotli, parse_accept_encoding
+
+# Already-compressed formats (images) gain nothing from gzip/brotli
+COMPRESSIBLE = {".css", ".js", ".svg", ".json", ".txt", ".map"}
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+def build_assets(source: str, output: str, url_prefix: str = "/static", output_prefix: str = "/assets") -> Dict[str, str]:
+    """
+    Copy every non-HTML file under `source` to `output` with a content
+    hash in its name, next to .gz/.br variants for text formats.
+
+    Returns a manifest mapping original URLs (/static/css/site.css) to
+    fingerprinted ones (/assets/css/site.3f2a9c1b0d4e.css). Since a
+    changed file gets a new name, the fingerprinted URLs can be cached
+    forever. Files that already exist are left alone, so restarts only
+    redo work for assets that changed.
+    """
+    manifest = {}
+    for root, _, files in os.walk(source):
+        for filename in files:
+            if filename.endswith(".html"):
+                continue
+            path = os.path.join(root, filename)
+            relative = os.path.relpath(path, source).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(relative)
+            fingerprinted = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            target = os.path.join(output, fingerprinted)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(path, target)
+                if ext in COMPRESSIBLE:
+                    with open(target + ".gz", "wb") as f:
+                        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+                    if brotli is not None:
+                        with open(target + ".br", "wb") as f:
+                            f.write(brotli.compress(data, quality=11))
+
+            manifest[f"{url_prefix}/{relative}"] = f"{output_prefix}/{fingerprinted}"
+    return manifest
+
+
+def rewrite_asset_urls(html: bytes, manifest: Dict[str, str]) -> bytes:
+    """Point /static/... references in a page at their fingerprinted copies."""
+    def replace(match):
+        url = match.group(0).decode()
+        return manifest.get(url, url).encode()
+
+    return re.sub(rb"/static/[^\"'\s)?#]+", replace, html)
+
+
+class AssetFiles(StaticFiles):
+    """
+    StaticFiles for fingerprinted assets: serves a precompressed .br/.gz
+    sibling when the client accepts it, and marks everything immutable.
+    """
+
+    async def get_response(self, path, scope):
+        accepted = parse_accept_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        response = None
+        for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+            if encoding not in accepted:
+                continue
+            try:
+                response = await super().get_response(path + suffix, scope)
+            except HTTPException:
+                continue
+            response.headers["Content-Encoding"] = encoding
+            if response.status_code == 200:
+                response.headers["Content-Type"] = mimetypes.guess_type(path)[0] or "application/octet-stream"
+            break
+        if response is None:
+            response = await super().get_response(path, scope)
+        response.headers["Cache-Control"] = IMMUTABLE
+        response.headers["Vary"] = "Accept-Encoding"
+        return response
@@ -1,39 +1,47 @@
 import os
 import time
+import asyncio
+import functools
+import threading
 import mysql.connector
 import pandas as pd
 from mysql.connector import Error
 from dotenv import load_dotenv
 import logging
 from typing import Optional
+from datetime import datetime, timedelta
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .cache import TTLCache
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# session_id -> joined user record, shared by every request in this process
+session_cache = TTLCache(
+    maxsize=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SESSION_CACHE_TTL", "60")),
+)
+
 
 class DatabaseConnectionError(Exception):
     """Custom exception for database connection failures."""
     pass
 
 
-def get_db_connection(
+def _connect(
     max_retries: int = 12,  # 12 retries = 1 minute total (12 * 5 seconds)
     retry_delay: int = 5,  # 5 seconds between retries
 ) -> mysql.connector.MySQLConnection:
-    """Create database connection with retry mechanism."""
+    """Open a new physical database connection with retry mechanism."""
     connection: Optional[mysql.connector.MySQLConnection] = None
     attempt = 1
     last_error = None
 
     while attempt <= max_retries:
         try:
-            print(os.getenv("MYSQL_HOST"))
-            print(os.getenv('MYSQL_PORT'))
-            print(os.getenv("MYSQL_USER"))
-            print(os.getenv("MYSQL_PASSWORD"))
-            print(os.getenv("MYSQL_DATABASE"))
-            print(os.getenv('MYSQL_SSL_CA'))
             connection = mysql.connector.connect(
                 host=os.getenv("MYSQL_HOST"),
                 port=os.getenv('MYSQL_PORT'),
@@ -71,9 +79,438 @@ def get_db_connection(
         f"Failed to connect to database after {max_retries} attempts. "
         f"Last error: {last_error}"
     )
+
+
+class PooledConnection:
+    """
+    Proxy around a pooled MySQL connection.
+
+    Behaves like a regular connection, except that close() hands the
+    connection back to the pool instead of tearing down the socket.
+    """
+
+    def __init__(self, pool: "ConnectionPool", connection, created_at: float):
+        self._pool = pool
+        self._connection = connection
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def is_connected(self) -> bool:
+        if self._released:
+            return False
+        return self._connection.is_connected()
+
+    def close(self):
+        """Return the connection to the pool (safe to call more than once)."""
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._connection, self._created_at)
+
+
+class ConnectionPool:
+    """
+    Process-wide pool of MySQL connections.
+
+    Keeps up to `pool_size` idle connections around and allows up to
+    `max_overflow` extra connections under load, which are closed again
+    when returned. Idle connections are pinged on checkout and recycled
+    once they are older than `recycle` seconds.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 5,
+        max_overflow: int = 10,
+        recycle: int = 1800,
+        timeout: float = 30.0,
+    ):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.recycle = recycle
+        self.timeout = timeout
+
+        self._idle = deque()  # (connection, created_at), most recently used on the right
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(pool_size + max_overflow)
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "failed_health_checks": 0,
+            "overflow_closed": 0,
+            "waits": 0,
+            "timeouts": 0,
+        }
+        self._checked_out = 0
+
+    def get_connection(self) -> PooledConnection:
+        """Check out a healthy connection, opening a new one if needed."""
+        if self._closed:
+            raise DatabaseConnectionError("Connection pool is closed")
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["waits"] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self._stats["timeouts"] += 1
+                raise DatabaseConnectionError(
+                    f"Timed out after {self.timeout} seconds waiting for a database connection"
+                )
+
+        try:
+            connection, created_at = self._checkout_idle()
+            if connection is None:
+                connection = _connect()
+                created_at = time.monotonic()
+                with self._lock:
+                    self._stats["created"] += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._checked_out += 1
+            self._stats["checkouts"] += 1
+        return PooledConnection(self, connection, created_at)
+
+    def _checkout_idle(self):
+        """Pop idle connections until a healthy one is found."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None, None
+                connection, created_at = self._idle.pop()
+
+            if time.monotonic() - created_at > self.recycle:
+                with self._lock:
+                    self._stats["recycled"] += 1
+                self._discard(connection)
+                continue
+
+            try:
+                connection.ping(reconnect=False)
+                return connection, created_at
+            except Exception as e:
+                logger.warning(f"Discarding stale pooled connection: {e}")
+                with self._lock:
+                    self._stats["failed_health_checks"] += 1
+                self._discard(connection)
+
+    def _release(self, connection, created_at: float):
+        # No ping here: health is checked on the next checkout. in_transaction
+        # comes from the last server reply, so it costs no round trip.
+        keep = not self._closed
+        try:
+            if keep and connection.in_transaction:
+                # Never hand out a connection with a half-finished transaction
+                connection.rollback()
+        except Exception:
+            keep = False
+
+        with self._lock:
+            self._checked_out -= 1
+            if keep and len(self._idle) < self.pool_size:
+                self._idle.append((connection, created_at))
+                connection = None
+            elif keep:
+                self._stats["overflow_closed"] += 1
+
+        if connection is not None:
+            self._discard(connection)
+        self._slots.release()
+
+    @staticmethod
+    def _discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self) -> dict:
+        """Current pool usage and lifetime counters."""
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "max_overflow": self.max_overflow,
+                "recycle": self.recycle,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "overflow": max(0, self._checked_out + len(self._idle) - self.pool_size),
+                **self._stats,
+            }
+
+    def close(self):
+        """Close all idle connections and refuse further checkouts."""
+        self._closed = True
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for connection, _ in idle:
+            self._discard(connection)
+
+
+_pool: Optional[ConnectionPool] = None
+
+
+def init_pool() -> ConnectionPool:
+    """Create the process-wide connection pool (called from the app lifespan)."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "10")),
+            recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+            timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        )
+        logger.info("Database connection pool created")
+    return _pool
+
+
+def close_pool():
+    """Close the process-wide connection pool and its query executor."""
+    global _pool, _db_executor
+    if _db_executor is not None:
+        _db_executor.shutdown(wait=True)
+        _db_executor = None
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+        logger.info("Database connection pool closed")
+
+
+def get_pool_stats() -> Optional[dict]:
+    return _pool.stats() if _pool is not None else None
+
+
+def get_db_connection() -> PooledConnection:
+    """
+    Check out a connection from the process-wide pool.
+
+    Callers keep using connection.close() when done, which returns the
+    connection to the pool.
+    """
+    return init_pool().get_connection()
+
+
+_db_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_db_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool that every blocking query runs on.
+
+    It has one worker per pool connection, so queries queue up here
+    instead of blocking the event loop or waiting on a pool slot.
+    """
+    global _db_executor
+    if _db_executor is None:
+        pool = init_pool()
+        _db_executor = ThreadPoolExecutor(
+            max_workers=pool.pool_size + pool.max_overflow,
+            thread_name_prefix="db",
+        )
+    return _db_executor
+
+
+def run_in_db_executor(func):
+    """
+    Turn a blocking database helper into a coroutine.
+
+    The wrapped function runs on the database thread pool so that
+    mysql-connector calls never block the asyncio event loop. The
+    original function stays available as `.sync` for callers that are
+    already off the loop.
+    """
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _get_db_executor(), functools.partial(func, *args, **kwargs)
+        )
+
+    wrapper.sync = func
+    return wrapper
     
 
-async def setup_database():
+def _index_exists(cursor, table: str, index: str) -> bool:
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """,
+        (table, index),
+    )
+    return cursor.fetchone() is not None
+
+
+def _column_exists(cursor, table: str, column: str) -> bool:
+    cursor.execute(
+        """
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s
+        LIMIT 1
+    """,
+        (table, column),
+    )
+    return cursor.fetchone() is not None
+
+
+def _add_index(cursor, table: str, index: str, columns: str):
+    """Add an index unless it already exists (MySQL has no CREATE INDEX IF NOT EXISTS)."""
+    if not _index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {index} ({columns})")
+        logger.info(f"Added index {index} on {table}({columns})")
+
+
+def _drop_index(cursor, table: str, index: str):
+    """Drop an index if it exists."""
+    if _index_exists(cursor, table, index):
+        cursor.execute(f"ALTER TABLE {table} DROP INDEX {index}")
+        logger.info(f"Dropped index {index} on {table}")
+
+
+def _add_column(cursor, table: str, column: str, definition: str):
+    """Add a column unless it already exists."""
+    if not _column_exists(cursor, table, column):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"Added column {table}.{column}")
+
+
+def _migration_hot_path_indexes(cursor):
+    # Range/aggregate queries filter on mac_address and scan by timestamp;
+    # carrying value makes the index covering for the chart queries.
+    _add_index(cursor, "temperature", "idx_temperature_mac_time", "mac_address, timestamp, value")
+    # since-id polling, SSE catch-up and keyset paging filter on mac_address
+    # and walk by id. InnoDB may drop the implicit foreign key index on
+    # mac_address once the index above exists, so keep this one explicit.
+    _add_index(cursor, "temperature", "idx_temperature_mac_id", "mac_address, id")
+
+
+def _migration_rollup_tables(cursor):
+    for table in ("temperature_minute", "temperature_hour"):
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                mac_address VARCHAR(20) NOT NULL,
+                bucket_start DATETIME NOT NULL,
+                min_value FLOAT NOT NULL,
+                max_value FLOAT NOT NULL,
+                sum_value DOUBLE NOT NULL,
+                count INT NOT NULL,
+                PRIMARY KEY (mac_address, bucket_start),
+                INDEX idx_{table}_bucket (bucket_start)
+            )
+        """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            name VARCHAR(20) PRIMARY KEY,
+            watermark DATETIME NOT NULL
+        )
+    """)
+    # Rollup windows and retention sweeps scan every device by time
+    _add_index(cursor, "temperature", "idx_temperature_time", "timestamp")
+
+
+def _migration_user_coordinates(cursor):
+    # Geocoded users.location, filled in lazily by the weather endpoint
+    _add_column(cursor, "users", "latitude", "DOUBLE DEFAULT NULL")
+    _add_column(cursor, "users", "longitude", "DOUBLE DEFAULT NULL")
+    _add_column(cursor, "users", "location_name", "VARCHAR(255) DEFAULT NULL")
+
+
+def _migration_wardrobe_version(cursor):
+    # Bumped on every wardrobe change; /api/wardrobe derives its ETag from it
+    _add_column(cursor, "users", "wardrobe_version", "INT NOT NULL DEFAULT 0")
+
+
+def _migration_rollup_last_id(cursor):
+    # Highest raw reading id checked for late arrivals by the minute rollup
+    _add_column(cursor, "rollup_state", "last_id", "BIGINT DEFAULT NULL")
+
+
+def _migration_drop_redundant_indexes(cursor):
+    # Databases that ran the first version of migration 1 lack the
+    # (mac_address, id) index and have two indexes that only duplicate
+    # the foreign key indexes on user_id.
+    _add_index(cursor, "temperature", "idx_temperature_mac_id", "mac_address, id")
+    for table, index in (("sessions", "idx_sessions_user_created"), ("devices", "idx_devices_user_mac")):
+        if not _index_exists(cursor, table, index):
+            continue
+        # The foreign key needs an index led by user_id; InnoDB may have
+        # dropped its own in favour of the one we are removing
+        cursor.execute(
+            """
+            SELECT 1 FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = %s AND index_name <> %s
+              AND column_name = 'user_id' AND seq_in_index = 1
+            LIMIT 1
+        """,
+            (table, index),
+        )
+        if cursor.fetchone() is None:
+            _add_index(cursor, table, f"idx_{table}_user", "user_id")
+        _drop_index(cursor, table, index)
+
+
+# Ordered list of (version, name, migration). Migrations must be idempotent:
+# MySQL commits DDL implicitly, so a crash can leave one half-applied.
+MIGRATIONS = [
+    (1, "hot path indexes", _migration_hot_path_indexes),
+    (2, "temperature rollup tables", _migration_rollup_tables),
+    (3, "user location coordinates", _migration_user_coordinates),
+    (4, "wardrobe version", _migration_wardrobe_version),
+    (5, "rollup late reading tracking", _migration_rollup_last_id),
+    (6, "drop redundant user_id indexes", _migration_drop_redundant_indexes),
+]
+
+
+def run_migrations(connection):
+    """Apply every migration newer than the recorded schema version."""
+    cursor = connection.cursor()
+    try:
+        # Only one app worker migrates at a time
+        cursor.execute("SELECT GET_LOCK('schema_migrations', 60)")
+        if cursor.fetchone()[0] != 1:
+            raise Exception("Timed out waiting for the schema migration lock")
+
+        try:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INT PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            current = cursor.fetchone()[0]
+
+            for version, name, migration in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"Applying migration {version}: {name}")
+                migration(cursor)
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, name)
+                )
+                connection.commit()
+
+            logger.info(f"Database schema at version {max([current] + [v for v, _, _ in MIGRATIONS])}")
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('schema_migrations')")
+            cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+@run_in_db_executor
+def setup_database():
     """Creates users, devices, wardrobe, and sessions tables."""
 
     # Define table schemas
@@ -146,6 +583,9 @@ async def setup_database():
 
         connection.commit()  # Commit all changes
 
+        # Bring existing deployments up to the current schema version
+        run_migrations(connection)
+
     except Exception as e:
         logger.error(f"Database setup failed: {e}")
         raise  # Rethrow exception to avoid silent failure
@@ -153,12 +593,13 @@ async def setup_database():
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
             logger.info("Database connection closed")
 
 
-async def add_user(name: str, email: str, password: str, location: str) -> int:
+@run_in_db_executor
+def add_user(name: str, email: str, password: str, location: str) -> int:
     """Insert a new user into the database and return the user ID."""
     connection = None
     cursor = None
@@ -186,11 +627,17 @@ async def add_user(name: str, email: str, password: str, location: str) -> int:
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()       
 
 
-async def add_clothes(name: str, user_id: int, type: str, color: str):
+def _bump_wardrobe_version(cursor, user_id: int):
+    """Mark a user's wardrobe as changed (call inside the same transaction)."""
+    cursor.execute("UPDATE users SET wardrobe_version = wardrobe_version + 1 WHERE user_id = %s", (user_id,))
+
+
+@run_in_db_executor
+def add_clothes(name: str, user_id: int, type: str, color: str):
     connection = None
     cursor = None
     try:
@@ -201,6 +648,7 @@ async def add_clothes(name: str, user_id: int, type: str, color: str):
             "INSERT INTO wardrobe (name, user_id, type, color) VALUES (%s, %s, %s, %s)",
             (name, user_id, type, color)
         )
+        _bump_wardrobe_version(cursor, user_id)
         connection.commit()
 
     except Exception as e:
@@ -211,11 +659,12 @@ async def add_clothes(name: str, user_id: int, type: str, color: str):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def remove_clothes(clothes_id: int, user_id: int):
+@run_in_db_executor
+def remove_clothes(clothes_id: int, user_id: int):
     connection = None
     cursor = None
     try:
@@ -226,6 +675,8 @@ async def remove_clothes(clothes_id: int, user_id: int):
             "DELETE FROM wardrobe WHERE id=%s AND user_id=%s",
             (clothes_id, user_id)
         )
+        if cursor.rowcount:
+            _bump_wardrobe_version(cursor, user_id)
         connection.commit()
 
     except Exception as e:
@@ -236,11 +687,12 @@ async def remove_clothes(clothes_id: int, user_id: int):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()              
 
 
-async def get_user_clothes(user_id: int):
+@run_in_db_executor
+def get_user_clothes(user_id: int):
     connection = None
     cursor = None
     try:
@@ -266,15 +718,36 @@ async def get_user_clothes(user_id: int):
         connection.close()   
 
 
-async def update_clothes(clothes_id, name, clothes_type, color):
+@run_in_db_executor
+def get_wardrobe_version(user_id: int) -> int:
+    """Current wardrobe version of a user (a primary key lookup, cheap enough for every request)."""
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.execute("SELECT wardrobe_version FROM users WHERE user_id = %s", (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else 0
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def update_clothes(clothes_id, name, clothes_type, color, user_id):
     "Updates users clothes info"
     connection = None
     cursor = None
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
-        query =  "UPDATE wardrobe SET name = %s, type = %s, color = %s WHERE id = %s"
-        cursor.execute(query, (name, clothes_type, color, clothes_id))
+        query =  "UPDATE wardrobe SET name = %s, type = %s, color = %s WHERE id = %s AND user_id = %s"
+        cursor.execute(query, (name, clothes_type, color, clothes_id, user_id))
+        if cursor.rowcount:
+            _bump_wardrobe_version(cursor, user_id)
         connection.commit()
     except Exception as e:
         connection.rollback()
@@ -282,11 +755,12 @@ async def update_clothes(clothes_id, name, clothes_type, color):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def remove_user_device(device_id, mac_address):
+@run_in_db_executor
+def remove_user_device(device_id, mac_address):
     "deletes device from db"
     connection = None
     cursor = None
@@ -304,11 +778,12 @@ async def remove_user_device(device_id, mac_address):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def update_user_device(name, mac_address, device_id):
+@run_in_db_executor
+def update_user_device(name, mac_address, device_id):
     "update device info"
     connection = None
     cursor = None
@@ -324,11 +799,12 @@ async def update_user_device(name, mac_address, device_id):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close() 
 
 
-async def get_user_by_email(email: str) -> Optional[dict]:
+@run_in_db_executor
+def get_user_by_email(email: str) -> Optional[dict]:
     """Retrieve user from database by email."""
     connection = None
     cursor = None
@@ -340,11 +816,12 @@ async def get_user_by_email(email: str) -> Optional[dict]:
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def get_user_by_id(user_id: int) -> Optional[dict]:
+@run_in_db_executor
+def get_user_by_id(user_id: int) -> Optional[dict]:
     """
     Retrieve user from database by ID.
 
@@ -364,11 +841,12 @@ async def get_user_by_id(user_id: int) -> Optional[dict]:
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def create_session(user_id: int, session_id: str) -> bool:
+@run_in_db_executor
+def create_session(user_id: int, session_id: str) -> bool:
     """Create a new session in the database."""
     connection = None
     cursor = None
@@ -383,11 +861,12 @@ async def create_session(user_id: int, session_id: str) -> bool:
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def get_session(session_id: str) -> Optional[dict]:
+@run_in_db_executor
+def get_session(session_id: str) -> Optional[dict]:
     """Retrieve session from database."""
     connection = None
     cursor = None
@@ -406,12 +885,63 @@ async def get_session(session_id: str) -> Optional[dict]:
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
+            connection.close()
+
+
+async def get_session_user(session_id: str) -> Optional[dict]:
+    """
+    Resolve a session ID to its user record.
+
+    Results are cached in session_cache, so repeated requests with the
+    same cookie skip the database until the entry expires or is
+    invalidated by delete_session / update_user. Cache hits are answered
+    on the event loop; only misses wait for the DB executor.
+    """
+    user = session_cache.get(session_id)
+    if user is not None:
+        return user
+    return await _load_session_user(session_id)
+
+
+@run_in_db_executor
+def _load_session_user(session_id: str) -> Optional[dict]:
+    """Look up a session's user with a single query and cache it."""
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            """
+            SELECT u.*
+            FROM sessions s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.id = %s
+        """,
+            (session_id,),
+        )
+        user = cursor.fetchone()
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
             connection.close()
 
+    if user:
+        session_cache.set(session_id, user)
+    return user
 
-async def delete_session(session_id: str) -> bool:
+
+def invalidate_user_sessions(user_id: int) -> int:
+    """Drop all cached sessions that belong to a user."""
+    return session_cache.discard_where(lambda _, user: user["user_id"] == user_id)
+
+
+@run_in_db_executor
+def delete_session(session_id: str) -> bool:
     """Delete a session from the database."""
+    session_cache.pop(session_id)
     connection = None
     cursor = None
     try:
@@ -423,11 +953,12 @@ async def delete_session(session_id: str) -> bool:
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def add_temperature(mac_address: str, value: float, unit: str, timestamp: str) -> int:
+@run_in_db_executor
+def add_temperature(mac_address: str, value: float, unit: str, timestamp: str) -> int:
     """Insert a new user into the database and return the user ID."""
     connection = None
     cursor = None
@@ -441,11 +972,7 @@ async def add_temperature(mac_address: str, value: float, unit: str, timestamp:
         )
         connection.commit()
 
-        # Get the user_id of the newly created user
-        cursor.execute("SELECT LAST_INSERT_ID()")
-        user_id = cursor.fetchone()[0]
-
-        return user_id  # Return the newly created user ID
+        return cursor.lastrowid  # Return the new reading's ID
 
     except Exception as e:
         if connection:
@@ -455,17 +982,611 @@ async def add_temperature(mac_address: str, value: float, unit: str, timestamp:
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()   
 
 
-async def update_user(user_id, name, location, new_hashed_password=None):
+@run_in_db_executor
+def add_temperatures(readings: list) -> tuple:
+    """
+    Insert many (mac_address, value, unit, timestamp) readings in one transaction.
+
+    Readings for devices that are not registered are skipped rather than
+    failing the whole batch. Returns the set of unknown MAC addresses and
+    the ids of the inserted rows, in the order the known readings were given.
+    """
+    if not readings:
+        return set(), []
+
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+
+        macs = sorted({reading[0] for reading in readings})
+        placeholders = ", ".join(["%s"] * len(macs))
+        cursor.execute(
+            f"SELECT mac_address FROM devices WHERE mac_address IN ({placeholders})",
+            macs
+        )
+        known = {row[0] for row in cursor.fetchall()}
+        unknown = set(macs) - known
+
+        rows = [reading for reading in readings if reading[0] in known]
+        ids = []
+        if rows:
+            # mysql-connector rewrites this into a single multi-row INSERT
+            cursor.executemany(
+                "INSERT INTO temperature (mac_address, value, unit, timestamp) VALUES (%s, %s, %s, %s)",
+                rows
+            )
+            # lastrowid is the first id of the statement, but the rest need
+            # not be consecutive (auto_increment_increment, other servers).
+            # Read them back: this transaction's snapshot was taken by the
+            # device lookup above, so the only rows it sees from there on are
+            # its own, numbered in insert order.
+            known_macs = sorted(known)
+            cursor.execute(
+                f"SELECT id FROM temperature WHERE id >= %s AND mac_address IN ({', '.join(['%s'] * len(known_macs))}) "
+                f"ORDER BY id LIMIT %s",
+                [cursor.lastrowid] + known_macs + [len(rows)]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        connection.commit()
+        return unknown, ids
+
+    except Exception as e:
+        if connection:
+            connection.rollback()  # Rollback on failure
+        raise Exception(f"Failed to insert readings: {e}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def register_devices(mac_addresses: list):
+    """Register any of the given MAC addresses that aren't registered yet (as unassigned devices)."""
+    if not mac_addresses:
+        return
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.executemany(
+            "INSERT IGNORE INTO devices (mac_address) VALUES (%s)",
+            [(mac_address,) for mac_address in mac_addresses]
+        )
+        connection.commit()
+
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        raise Exception(f"Failed to register devices: {e}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+def _temperature_range_clause(mac_address: str, start_date: Optional[str], end_date: Optional[str],
+                              column: str = "timestamp"):
+    condition = ["mac_address = %s"]
+    params = [mac_address]
+    if start_date:
+        condition.append(f"{column} >= %s")
+        params.append(start_date)
+    if end_date:
+        condition.append(f"{column} <= %s")
+        params.append(end_date)
+    return " AND ".join(condition), params
+
+
+# Stand-in watermark for a rollup level that has not run yet (DATETIME minimum)
+_NO_WATERMARK = datetime(1000, 1, 1)
+
+# Rollup level -> (table, bucket width in seconds)
+ROLLUP_LEVELS = {
+    "minute": ("temperature_minute", 60),
+    "hour": ("temperature_hour", 3600),
+}
+
+
+@run_in_db_executor
+def get_temperature_span(mac_address: str, start_date: Optional[str] = None,
+                         end_date: Optional[str] = None) -> Optional[tuple]:
+    """
+    Return the (first, last) unix timestamps of a device's readings in a range.
+
+    Both rollups are included so that ranges whose raw rows were already
+    removed by the retention policy still have their full span.
+    """
+    raw_where, raw_params = _temperature_range_clause(mac_address, start_date, end_date)
+    parts = [f"SELECT MIN(timestamp) AS first, MAX(timestamp) AS last FROM temperature WHERE {raw_where}"]
+    params = list(raw_params)
+    for table, width in ROLLUP_LEVELS.values():
+        where, level_params = _temperature_range_clause(mac_address, start_date, end_date, "bucket_start")
+        # A rollup bucket covers readings up to the end of its width
+        parts.append(
+            f"SELECT MIN(bucket_start), MAX(bucket_start) + INTERVAL {width - 1} SECOND FROM {table} WHERE {where}"
+        )
+        params += level_params
+
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.execute(
+            f"""
+            SELECT UNIX_TIMESTAMP(MIN(first)), UNIX_TIMESTAMP(MAX(last))
+            FROM ({" UNION ALL ".join(parts)}) AS span
+        """,
+            params
+        )
+        first, last = cursor.fetchone()
+        if first is None:
+            return None
+        return int(first), int(last)
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def get_temperature_buckets(mac_address: str, bucket_seconds: int,
+                            start_date: Optional[str] = None, end_date: Optional[str] = None,
+                            source: str = "raw") -> list:
+    """
+    Aggregate a device's readings into fixed-width time buckets in SQL.
+
+    source picks the table to read: "raw" readings, or the "minute" /
+    "hour" rollups (bucket_seconds must then be a multiple of the rollup
+    width). Rollups only cover time before their watermark; the rest of
+    the range is filled in from the finer minute rollup and raw readings,
+    so the newest buckets are complete too.
+    """
+    raw_where, raw_params = _temperature_range_clause(mac_address, start_date, end_date)
+    if source == "raw":
+        query = f"""
+            SELECT FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(timestamp) / %s) * %s) AS bucket_start,
+                   MIN(value) AS min, MAX(value) AS max, AVG(value) AS avg, COUNT(*) AS count
+            FROM temperature
+            WHERE {raw_where}
+            GROUP BY 1
+            ORDER BY 1
+        """
+        params = raw_params
+    else:
+        # Partial (min, max, sum, count) aggregates per source, split at the
+        # watermarks so no reading is counted twice
+        minute_where, minute_params = _temperature_range_clause(mac_address, start_date, end_date, "bucket_start")
+        parts = []
+        if source == "hour":
+            parts.append((
+                f"""SELECT bucket_start AS t, min_value AS mn, max_value AS mx, sum_value AS sm, count AS cnt
+                    FROM temperature_hour WHERE {minute_where} AND bucket_start < %s""",
+                minute_params, "hour_watermark",
+            ))
+            parts.append((
+                f"""SELECT bucket_start, min_value, max_value, sum_value, count
+                    FROM temperature_minute WHERE {minute_where} AND bucket_start >= %s AND bucket_start < %s""",
+                minute_params, "hour_and_minute_watermark",
+            ))
+        else:
+            parts.append((
+                f"""SELECT bucket_start AS t, min_value AS mn, max_value AS mx, sum_value AS sm, count AS cnt
+                    FROM temperature_minute WHERE {minute_where} AND bucket_start < %s""",
+                minute_params, "minute_watermark",
+            ))
+        parts.append((
+            f"""SELECT timestamp, value, value, value, 1
+                FROM temperature WHERE {raw_where} AND timestamp >= %s""",
+            raw_params, "minute_watermark",
+        ))
+        query = f"""
+            SELECT FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(t) / %s) * %s) AS bucket_start,
+                   MIN(mn) AS min, MAX(mx) AS max, SUM(sm) / SUM(cnt) AS avg, SUM(cnt) AS count
+            FROM ({" UNION ALL ".join(sql for sql, _, _ in parts)}) AS parts
+            GROUP BY 1
+            ORDER BY 1
+        """
+
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor(dictionary=True)
+        if source != "raw":
+            # No watermark yet means nothing is rolled up: read it all from the finer source
+            hour_watermark = _read_watermark(cursor, "hour") or _NO_WATERMARK
+            minute_watermark = _read_watermark(cursor, "minute") or _NO_WATERMARK
+            bounds = {
+                "hour_watermark": [hour_watermark],
+                "hour_and_minute_watermark": [hour_watermark, minute_watermark],
+                "minute_watermark": [minute_watermark],
+            }
+            params = []
+            for _, part_params, bound in parts:
+                params += part_params + bounds[bound]
+        cursor.execute(query, [bucket_seconds, bucket_seconds] + params)
+        return cursor.fetchall()
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+# Streaming exports hold a connection for the whole download, however slow
+# the client is, so they get their own connections (outside the pool) and
+# only this many run at once.
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "3"))
+_export_slots = threading.BoundedSemaphore(EXPORT_CONCURRENCY)
+
+
+def export_slot_free() -> bool:
+    """Whether another export could start right now."""
+    if _export_slots.acquire(blocking=False):
+        _export_slots.release()
+        return True
+    return False
+
+
+def iter_temperature_rows(mac_address: str, start_date: Optional[str] = None,
+                          end_date: Optional[str] = None, chunk_size: int = 5000):
+    """
+    Yield a device's (id, value, unit, timestamp) readings in chunks.
+
+    Uses an unbuffered cursor, so MySQL streams rows as they are fetched
+    and memory stays flat no matter how long the history is. The rows
+    come over a dedicated connection rather than a pooled one, opened on
+    the first chunk and closed when the generator is exhausted or closed,
+    so slow downloads never starve other requests of pooled connections.
+    At most EXPORT_CONCURRENCY of these run at once.
+    """
+    where, params = _temperature_range_clause(mac_address, start_date, end_date)
+    if not _export_slots.acquire(timeout=30):
+        raise DatabaseConnectionError("Too many exports running")
+    connection = None
+    cursor = None
+    try:
+        connection = _connect(max_retries=1)
+        cursor = connection.cursor(buffered=False)
+        cursor.execute(
+            f"SELECT id, value, unit, timestamp FROM temperature WHERE {where} ORDER BY id",
+            params
+        )
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        if cursor:
+            try:
+                cursor.close()
+            except Error:
+                # Client went away mid-stream; closing the connection discards the unread rows
+                pass
+        if connection:
+            try:
+                connection.close()
+            except Error:
+                pass
+        _export_slots.release()
+
+
+def _read_watermark(cursor, name: str):
+    cursor.execute("SELECT watermark FROM rollup_state WHERE name = %s", (name,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _write_watermark(cursor, name: str, watermark):
+    cursor.execute(
+        "INSERT INTO rollup_state (name, watermark) VALUES (%s, %s) "
+        "ON DUPLICATE KEY UPDATE watermark = VALUES(watermark)",
+        (name, watermark)
+    )
+
+
+def _read_last_id(cursor):
+    cursor.execute("SELECT last_id FROM rollup_state WHERE name = 'minute'")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _write_last_id(cursor, last_id: int):
+    cursor.execute("UPDATE rollup_state SET last_id = %s WHERE name = 'minute'", (last_id,))
+
+
+def _repair_late_readings(cursor, after_id: int, up_to_id: int, late_before: datetime):
+    """
+    Merge readings that arrived after their bucket was rolled up (e.g.
+    replayed by the bridge after an outage) into the minute and hour
+    buckets, so they are neither missing from the rollups nor lost to
+    raw retention.
+
+    The late rows are added to the existing rollup rows rather than the
+    buckets being recomputed from raw, since raw rows of old buckets may
+    already have been purged.
+    """
+    merge = """
+        INSERT INTO {table} (mac_address, bucket_start, min_value, max_value, sum_value, count)
+        SELECT mac_address, FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(timestamp) / %s) * %s),
+               MIN(value), MAX(value), SUM(value), COUNT(*)
+        FROM temperature
+        WHERE id > %s AND id <= %s AND timestamp < %s
+        GROUP BY 1, 2
+        ON DUPLICATE KEY UPDATE
+            min_value = LEAST(min_value, VALUES(min_value)), max_value = GREATEST(max_value, VALUES(max_value)),
+            sum_value = sum_value + VALUES(sum_value), count = count + VALUES(count)
+    """
+    cursor.execute(merge.format(table="temperature_minute"), (60, 60, after_id, up_to_id, late_before))
+    repaired = cursor.rowcount > 0
+
+    # Hours at or past the hour watermark are rolled up from the (now
+    # merged) minutes later; only closed hours need the late rows added
+    hour_watermark = _read_watermark(cursor, "hour")
+    if hour_watermark is not None:
+        cursor.execute(merge.format(table="temperature_hour"),
+                       (3600, 3600, after_id, up_to_id, min(late_before, hour_watermark)))
+    if repaired:
+        logger.info(f"Merged late readings into rollups (ids {after_id + 1}-{up_to_id})")
+
+
+def _truncate(moment: datetime, seconds: int) -> datetime:
+    """Round a datetime down to the start of its minute (60) or hour (3600)."""
+    moment = moment.replace(second=0, microsecond=0)
+    if seconds >= 3600:
+        moment = moment.replace(minute=0)
+    return moment
+
+
+@run_in_db_executor
+def run_temperature_rollup(grace_seconds: int = 300, max_window_hours: int = 24,
+                           max_late_ids: int = 100000) -> bool:
+    """
+    Fold raw readings into the per-minute table and minutes into the hourly table.
+
+    Each level keeps a watermark in rollup_state. A run recomputes the
+    buckets from (watermark - grace) up to the last closed bucket, so
+    slightly late readings are picked up and re-running is harmless.
+    Readings later than that are found by id (everything inserted since
+    the previous run) and their buckets are recomputed. At most
+    max_window_hours (and max_late_ids new readings) are processed per
+    run, which keeps each transaction small while catching up on a large
+    backlog.
+
+    Returns True if a backlog remains and another run should follow.
+    """
+    connection = None
+    cursor = None
+    backlog = False
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+
+        # Skip this run if another worker is already rolling up
+        cursor.execute("SELECT GET_LOCK('temperature_rollup', 0)")
+        if cursor.fetchone()[0] != 1:
+            return False
+
+        try:
+            # Readings up to here are covered by this run, either by the window or as late arrivals
+            cursor.execute("SELECT MAX(id) FROM temperature")
+            max_id = cursor.fetchone()[0]
+            late_before = None
+
+            sources = {
+                "minute": ("temperature", "timestamp",
+                           "MIN(value), MAX(value), SUM(value), COUNT(*)"),
+                "hour": ("temperature_minute", "bucket_start",
+                         "MIN(min_value), MAX(max_value), SUM(sum_value), SUM(count)"),
+            }
+            for level, (source, column, aggregates) in sources.items():
+                table, width = ROLLUP_LEVELS[level]
+                watermark = _read_watermark(cursor, level)
+                if watermark is None:
+                    cursor.execute(f"SELECT MIN({column}) FROM {source}")
+                    watermark = cursor.fetchone()[0]
+                    if watermark is None:
+                        continue
+                    watermark = _truncate(watermark, width)
+
+                # Hours can only be closed once their minutes are rolled up
+                limit = datetime.now() if level == "minute" else _read_watermark(cursor, "minute")
+                if limit is None:
+                    continue
+                closed = _truncate(limit, width)
+                end = min(closed, watermark + timedelta(hours=max_window_hours))
+                backlog = backlog or end < closed
+                # Re-aggregate a little before the watermark to pick up late rows
+                rewind = grace_seconds if level == "minute" else width
+                start = watermark - timedelta(seconds=rewind)
+                if level == "minute" and _read_watermark(cursor, "minute") is not None:
+                    late_before = start
+                if end <= start:
+                    continue
+
+                cursor.execute(
+                    f"""
+                    INSERT INTO {table} (mac_address, bucket_start, min_value, max_value, sum_value, count)
+                    SELECT mac_address, FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP({column}) / %s) * %s), {aggregates}
+                    FROM {source}
+                    WHERE {column} >= %s AND {column} < %s
+                    GROUP BY 1, 2
+                    ON DUPLICATE KEY UPDATE
+                        min_value = VALUES(min_value), max_value = VALUES(max_value),
+                        sum_value = VALUES(sum_value), count = VALUES(count)
+                """,
+                    (width, width, start, end)
+                )
+                _write_watermark(cursor, level, max(watermark, end))
+                connection.commit()
+
+            last_id = _read_last_id(cursor)
+            if max_id is not None and _read_watermark(cursor, "minute") is not None:
+                up_to_id = max_id
+                if last_id is not None and late_before is not None:
+                    up_to_id = min(max_id, last_id + max_late_ids)
+                    backlog = backlog or up_to_id < max_id
+                    _repair_late_readings(cursor, last_id, up_to_id, late_before)
+                # The first run rolls up everything, so there is nothing late to look for
+                _write_last_id(cursor, up_to_id)
+                connection.commit()
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK('temperature_rollup')")
+            cursor.fetchone()
+
+        return backlog
+
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        raise Exception(f"Failed to roll up temperature data: {e}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def purge_temperature_batch(table: str, older_than: datetime, batch_size: int) -> int:
+    """
+    Delete one batch of rows older than a cutoff from a temperature table.
+
+    Raw rows are never deleted past the minute rollup watermark or before
+    the rollup has checked them for late arrivals, so data is only removed
+    once it has been compacted into the rollups. Returns
+    the number of rows deleted.
+    """
+    column = "timestamp" if table == "temperature" else "bucket_start"
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        if table == "temperature":
+            watermark = _read_watermark(cursor, "minute")
+            last_id = _read_last_id(cursor)
+            if watermark is None or last_id is None:
+                return 0
+            # Late readings newer than last_id haven't been rolled up yet
+            cursor.execute(
+                "DELETE FROM temperature WHERE timestamp < %s AND id <= %s LIMIT %s",
+                (min(older_than, watermark), last_id, batch_size)
+            )
+        else:
+            cursor.execute(
+                f"DELETE FROM {table} WHERE {column} < %s LIMIT %s",
+                (older_than, batch_size)
+            )
+        deleted = cursor.rowcount
+        connection.commit()
+        return deleted
+
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        raise Exception(f"Failed to purge {table}: {e}")
+
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def count_temperature_rows(mac_address: str, start_date: Optional[str] = None,
+                           end_date: Optional[str] = None, limit: int = 100000) -> int:
+    """Count a device's raw readings in a range, stopping at `limit` so huge ranges stay cheap."""
+    where, params = _temperature_range_clause(mac_address, start_date, end_date)
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM temperature WHERE {where} LIMIT %s) AS capped",
+            params + [limit]
+        )
+        return cursor.fetchone()[0]
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def get_temperature_series(mac_address: str, start_date: Optional[str] = None,
+                           end_date: Optional[str] = None, source: str = "raw") -> pd.DataFrame:
+    """
+    Load a device's (timestamp, value) series for a range as a DataFrame.
+
+    With source "minute" or "hour" the series is the per-bucket averages
+    from that rollup (see get_temperature_buckets) instead of raw readings.
+    """
+    if source != "raw":
+        _, width = ROLLUP_LEVELS[source]
+        rows = get_temperature_buckets.sync(mac_address, width, start_date, end_date, source)
+        series = pd.DataFrame([(row["bucket_start"], row["avg"]) for row in rows], columns=["timestamp", "value"])
+        series["timestamp"] = pd.to_datetime(series["timestamp"])
+        series["value"] = series["value"].astype(float)
+        return series
+
+    where, params = _temperature_range_clause(mac_address, start_date, end_date)
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.execute(
+            f"SELECT timestamp, value FROM temperature WHERE {where} ORDER BY timestamp",
+            params
+        )
+        series = pd.DataFrame(cursor.fetchall(), columns=["timestamp", "value"])
+        series["timestamp"] = pd.to_datetime(series["timestamp"])
+        series["value"] = series["value"].astype(float)
+        return series
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def update_user(user_id, name, location, new_hashed_password=None):
     """Updates users info"""
     connection = None
     cursor = None
     try:
         connection = get_db_connection()
         cursor = connection.cursor()
+        # Geocoded coordinates only stay valid while the location is unchanged
+        cursor.execute(
+            """
+            UPDATE users
+            SET latitude = NULL, longitude = NULL, location_name = NULL
+            WHERE user_id = %s AND location <> %s
+        """,
+            (user_id, location),
+        )
         if new_hashed_password:
             query = "UPDATE users SET name = %s, location = %s, password = %s WHERE user_id = %s"
             cursor.execute(query, (name, location, new_hashed_password, user_id))
@@ -473,6 +1594,7 @@ async def update_user(user_id, name, location, new_hashed_password=None):
             query = "UPDATE users SET name = %s, location = %s WHERE user_id = %s"
             cursor.execute(query, (name, location, user_id))
         connection.commit()
+        invalidate_user_sessions(user_id)
     except Exception as e:
         if connection:
             connection.rollback()
@@ -480,11 +1602,63 @@ async def update_user(user_id, name, location, new_hashed_password=None):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
             connection.close()
 
 
-async def get_users_location(user_id):
+@run_in_db_executor
+def update_user_password(user_id, hashed_password):
+    """Replace a user's password hash (e.g. after rehashing with a new cost)"""
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.execute("UPDATE users SET password = %s WHERE user_id = %s", (hashed_password, user_id))
+        connection.commit()
+        invalidate_user_sessions(user_id)
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        raise Exception(f"Failed to update password: {e}")
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def set_user_coordinates(user_id, location, latitude, longitude, location_name):
+    """Store the geocoded coordinates of a user's location"""
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        # Only if the location wasn't changed while we were geocoding it
+        cursor.execute(
+            """
+            UPDATE users SET latitude = %s, longitude = %s, location_name = %s
+            WHERE user_id = %s AND location = %s
+        """,
+            (latitude, longitude, location_name, user_id, location),
+        )
+        connection.commit()
+        invalidate_user_sessions(user_id)
+    except Exception as e:
+        if connection:
+            connection.rollback()
+        raise Exception(f"Failed to store user coordinates: {e}")
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def get_users_location(user_id):
     connection = None
     cursor = None
     try:
@@ -501,7 +1675,24 @@ async def get_users_location(user_id):
     finally:
         if cursor:
             cursor.close()
-        if connection and connection.is_connected():
+        if connection:
+            connection.close()
+
+
+@run_in_db_executor
+def get_user_device_macs(user_id: int) -> list:
+    """Return the MAC addresses of every device assigned to a user."""
+    connection = None
+    cursor = None
+    try:
+        connection = get_db_connection()
+        cursor = connection.cursor()
+        cursor.execute("SELECT mac_address FROM devices WHERE user_id = %s", (user_id,))
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        if cursor:
+            cursor.close()
+        if connection:
             connection.close()
 
 
@@ -0,0 +1,102 @@
+import importlib.util
+import os
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+# HTTP/2 needs the optional h2 package (pip install "httpx[http2]")
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class HTTPClientMetrics:
+    """
+    Per-endpoint request counters for an httpx client, fed by its event hooks.
+
+    Latency is measured up to the response headers, which is what a
+    cold connection (DNS + TCP + TLS) slows down.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.endpoints = {}  # path -> counters
+
+    def _entry(self, path: str) -> dict:
+        return self.endpoints.setdefault(
+            path, {"requests": 0, "errors": 0, "failures": 0, "total_ms": 0.0, "max_ms": 0.0}
+        )
+
+    async def on_request(self, request: httpx.Request):
+        request.extensions["started_at"] = time.monotonic()
+
+    async def on_response(self, response: httpx.Response):
+        started_at = response.request.extensions.get("started_at")
+        elapsed_ms = (time.monotonic() - started_at) * 1000 if started_at else 0.0
+        with self._lock:
+            entry = self._entry(response.request.url.path)
+            entry["requests"] += 1
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+            if response.status_code >= 400:
+                entry["errors"] += 1
+
+    def record_failure(self, url: str):
+        """Count a request that never got a response (timeout, connection error)."""
+        with self._lock:
+            self._entry(httpx.URL(url).path)["failures"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                path: {
+                    "requests": entry["requests"],
+                    "errors": entry["errors"],
+                    "failures": entry["failures"],
+                    "avg_ms": round(entry["total_ms"] / entry["requests"], 1) if entry["requests"] else None,
+                    "max_ms": round(entry["max_ms"], 1),
+                }
+                for path, entry in self.endpoints.items()
+            }
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    Build the application-wide client for outbound API calls.
+
+    One client means one connection pool, so calls to the AI API reuse
+    warm keep-alive connections instead of paying a TLS handshake each
+    time. Timeouts are set per call; the default here only covers
+    anything that doesn't pass its own.
+    """
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", "10")),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+    )
+    transport = httpx.AsyncHTTPTransport(limits=limits, http2=HTTP2_AVAILABLE, retries=1)
+    metrics = HTTPClientMetrics()
+    client = httpx.AsyncClient(
+        transport=transport,
+        timeout=httpx.Timeout(30.0, connect=5.0),
+        event_hooks={"request": [metrics.on_request], "response": [metrics.on_response]},
+    )
+    client.metrics = metrics
+    return client
+
+
+def get_http_client_stats(client: Optional[httpx.AsyncClient]) -> Optional[dict]:
+    """Connection pool usage and per-endpoint metrics for a client from create_http_client."""
+    if client is None:
+        return None
+    # httpx doesn't expose its pool; look at the httpcore pool behind the transport
+    pool = getattr(client._transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    idle = sum(1 for connection in connections if connection.is_idle())
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "connections": len(connections),
+        "idle": idle,
+        "active": len(connections) - idle,
+        "endpoints": client.metrics.stats(),
+    }
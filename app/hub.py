@@ -0,0 +1,52 @@
+import asyncio
+from collections import defaultdict
+from typing import Iterable
+
+
+class ReadingHub:
+    """
+    In-process pub/sub for live sensor readings.
+
+    Each subscriber gets its own bounded queue and only receives readings
+    for the MAC addresses it subscribed to. A slow subscriber never blocks
+    ingestion: once its queue is full the oldest pending reading is
+    dropped. All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)  # mac_address -> {asyncio.Queue}
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, mac_addresses: Iterable[str]) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        for mac_address in mac_addresses:
+            self._subscribers[mac_address].add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue, mac_addresses: Iterable[str]):
+        for mac_address in mac_addresses:
+            subscribers = self._subscribers.get(mac_address)
+            if subscribers is None:
+                continue
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[mac_address]
+
+    def publish(self, reading: dict):
+        """Fan a reading out to everyone watching its device."""
+        self.published += 1
+        for queue in self._subscribers.get(reading["mac_address"], ()):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(reading)
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._subscribers),
+            "subscriptions": sum(len(queues) for queues in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped,
+        }
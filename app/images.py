@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Optional
+
+# Magic bytes -> (file extension, content type)
+IMAGE_TYPES = [
+    (b"\x89PNG\r\n\x1a\n", "png", "image/png"),
+    (b"\xff\xd8\xff", "jpg", "image/jpeg"),
+    (b"GIF8", "gif", "image/gif"),
+    (b"RIFF", "webp", "image/webp"),
+]
+CONTENT_TYPES = {ext: content_type for _, ext, content_type in IMAGE_TYPES}
+
+
+def sniff_image_type(data: bytes) -> str:
+    """File extension for image bytes, based on their magic number."""
+    for magic, ext, _ in IMAGE_TYPES:
+        if data.startswith(magic):
+            return ext
+    return "bin"
+
+
+class ImageStore:
+    """
+    Content-addressed on-disk store for generated images.
+
+    Each image is written once as `<sha256 of its bytes>.<ext>`, so its
+    name doubles as an ETag and can be cached by browsers forever. A
+    small index maps a generation request (prompt, width, height) to the
+    image it produced, so repeating a prompt needs no upstream call.
+    When the images take more than `max_bytes`, the least recently
+    written ones are removed.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 500 * 1024 * 1024):
+        self.directory = directory
+        self.index_directory = os.path.join(directory, "index")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.index_directory, exist_ok=True)
+
+    @staticmethod
+    def request_key(prompt: str, width: int, height: int) -> str:
+        return hashlib.sha256(json.dumps([prompt, width, height]).encode()).hexdigest()
+
+    def _path(self, name: str) -> Optional[str]:
+        # Names come from URLs; only accept what save() produces
+        digest, _, ext = name.partition(".")
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            return None
+        if ext not in CONTENT_TYPES and ext != "bin":
+            return None
+        return os.path.join(self.directory, name)
+
+    def lookup(self, prompt: str, width: int, height: int) -> Optional[str]:
+        """Name of the image previously generated for this request, if still stored."""
+        try:
+            with open(os.path.join(self.index_directory, self.request_key(prompt, width, height))) as f:
+                name = f.read().strip()
+        except OSError:
+            return None
+        path = self._path(name)
+        return name if path and os.path.exists(path) else None
+
+    def read(self, name: str) -> Optional[bytes]:
+        path = self._path(name)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def save(self, prompt: str, width: int, height: int, data: bytes) -> str:
+        """Store image bytes for a request and return the image name."""
+        name = f"{hashlib.sha256(data).hexdigest()}.{sniff_image_type(data)}"
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        with open(os.path.join(self.index_directory, self.request_key(prompt, width, height)), "w") as f:
+            f.write(name)
+        self.prune()
+        return name
+
+    def prune(self):
+        """Remove the oldest images once the store is over max_bytes."""
+        with self._lock:
+            images = []
+            total = 0
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    images.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+            images.sort()
+            for _, size, path in images:
+                if total <= self.max_bytes:
+                    break
+                # Index entries pointing at a removed image are ignored by lookup()
+                os.remove(path)
+                total -= size
+
+
+def content_type_of(name: str) -> str:
+    return CONTENT_TYPES.get(name.rpartition(".")[2], "application/octet-stream")
@@ -1,38 +1,78 @@
 from fastapi import FastAPI, Request, Response, HTTPException, Query, Depends
-from fastapi.responses import Response, HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import Response, HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 import httpx
 import uvicorn
 import os
 from dotenv import load_dotenv
-import bcrypt
 import uuid
 import mysql.connector
 from contextlib import asynccontextmanager
-from pydantic import BaseModel
-from datetime import datetime
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
 import base64
+import csv
+import io
+import json
+import asyncio
+import math
+import hashlib
+import pandas as pd
+
+from .downsample import lttb
+from .rollup import rollup_loop, RAW_RETENTION_DAYS, MINUTE_RETENTION_DAYS
+from .hub import ReadingHub
+from .mqtt_ingest import MQTTIngestor
+from .cache import TTLCache, DiskCache
+from .http_client import create_http_client, get_http_client_stats
+from .singleflight import SingleFlight
+from .images import ImageStore, content_type_of
+from .pages import PageCache, etag_matches
+from .assets import AssetFiles, build_assets, rewrite_asset_urls
+from .weather import WeatherError, create_weather_service
+from .passwords import (
+    hash_password,
+    verify_password,
+    needs_rehash,
+    get_password_stats,
+    shutdown_executor as shutdown_password_executor,
+)
 
 from .database import (
     get_db_connection,
+    init_pool,
+    close_pool,
+    get_pool_stats,
     setup_database,
     get_user_by_email,
-    get_user_by_id,
     create_session,
-    get_session,
+    get_session_user,
     delete_session,
     add_user,
-    get_db_connection,
     add_temperature,
+    add_temperatures,
+    get_temperature_span,
+    get_temperature_buckets,
+    get_temperature_series,
+    count_temperature_rows,
+    ROLLUP_LEVELS,
+    iter_temperature_rows,
+    export_slot_free,
+    get_user_device_macs,
     clear_database,
     add_clothes,
     remove_clothes,
     update_clothes,
     get_user_clothes,
+    get_wardrobe_version,
     update_user_device,
     remove_user_device,
     get_users_location,
-    update_user
+    update_user,
+    update_user_password,
+    set_user_coordinates
 )
 
 load_dotenv()
@@ -40,6 +80,57 @@ PID = os.getenv("UCSD_PID")
 email = os.getenv("UCSD_EMAIL")
 AI_API_URL = "https://ece140-wi25-api.frosty-sky-f43d.workers.dev/api/v1/ai/complete"
 AI_API_IMAGE = "https://ece140-wi25-api.frosty-sky-f43d.workers.dev/api/v1/ai/image"
+AI_TEXT_TIMEOUT = httpx.Timeout(float(os.getenv("AI_TEXT_TIMEOUT", "30")), connect=5.0)
+AI_IMAGE_TIMEOUT = httpx.Timeout(float(os.getenv("AI_IMAGE_TIMEOUT", "60")), connect=5.0)
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "1000"))
+MAX_PAGE_SIZE = 5000
+LTTB_MAX_ROWS = int(os.getenv("LTTB_MAX_ROWS", "200000"))  # raw readings LTTB may load for one request
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "1") == "1"  # rollup tables are only current while the job runs
+SSE_KEEPALIVE = 15  # seconds between keep-alive comments on idle streams
+
+# Live readings fan-out for dashboards connected to /api/stream/temperature
+reading_hub = ReadingHub()
+
+# Generated outfits, keyed by user, wardrobe contents, temperature bucket and condition
+OUTFIT_TEMP_BUCKET = int(os.getenv("OUTFIT_TEMP_BUCKET", "5"))  # degrees F per bucket
+outfit_cache = TTLCache(
+    maxsize=int(os.getenv("OUTFIT_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("OUTFIT_CACHE_TTL", "3600")),
+)
+# Optional second tier that survives restarts
+outfit_disk_cache = (
+    DiskCache(os.getenv("OUTFIT_CACHE_DIR"), ttl=float(os.getenv("OUTFIT_CACHE_DISK_TTL", "86400")))
+    if os.getenv("OUTFIT_CACHE_DIR") else None
+)
+
+# Fingerprinted copies of app/static, built at startup (outside app/ so --reload ignores them)
+ASSET_DIR = os.getenv("ASSET_DIR", "cache/assets")
+asset_manifest = {}  # /static/... URL -> /assets/... URL
+
+# HTML pages served from memory, reloaded when the file changes
+page_cache = PageCache(
+    check_interval=float(os.getenv("PAGE_CHECK_INTERVAL", "1")),
+    transform=lambda html: rewrite_asset_urls(html, asset_manifest),
+)
+PAGES = ["homepage", "signup", "login", "wardrobe", "dashboard", "profile"]
+
+# Geocoding and forecasts, cached server-side and shared between users
+weather_service = create_weather_service()
+
+# Serialized /api/wardrobe payloads, keyed by (user id, wardrobe version)
+wardrobe_cache = TTLCache(
+    maxsize=int(os.getenv("WARDROBE_CACHE_SIZE", "1000")),
+    ttl=float(os.getenv("WARDROBE_CACHE_TTL", "3600")),
+)
+
+# Identical AI requests that overlap in time share one upstream call
+ai_flights = SingleFlight()
+
+# Generated images, kept outside app/ so writes don't trigger --reload
+image_store = ImageStore(
+    os.getenv("IMAGE_CACHE_DIR", "cache/images"),
+    max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "500")) * 1024 * 1024,
+)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -48,21 +139,70 @@ async def lifespan(app: FastAPI):
     Handles database setup and cleanup in a more structured way.
     """
     # Startup: Setup resources
+    rollup_task = None
     try:
+        init_pool()
+        asset_manifest.update(build_assets("app/static", ASSET_DIR))
+        page_cache.preload(*(f"app/static/{page}.html" for page in PAGES))
+        app.state.http_client = create_http_client()
         await setup_database() 
         print("Database setup completed")
 
+        if ROLLUP_ENABLED:
+            rollup_task = asyncio.create_task(rollup_loop())
+
+        # Optional: consume sensor readings from MQTT directly instead of via the bridge
+        if os.getenv("MQTT_INGEST", "0") == "1":
+            app.state.mqtt_ingestor = MQTTIngestor(
+                asyncio.get_running_loop(),
+                SensorData,
+                store_readings,
+                broker=os.getenv("MQTT_BROKER", "broker.emqx.io"),
+                port=int(os.getenv("MQTT_PORT", "1883")),
+                topic=os.getenv("BASE_TOPIC") + "/#",
+                batch_size=int(os.getenv("MQTT_BATCH_SIZE", "500")),
+                flush_interval=float(os.getenv("MQTT_FLUSH_INTERVAL", "1")),
+            )
+            app.state.mqtt_ingestor.start()
+
         yield
     finally:
+        if getattr(app.state, "mqtt_ingestor", None):
+            await app.state.mqtt_ingestor.stop()
+        if rollup_task:
+            rollup_task.cancel()
+            try:
+                await rollup_task
+            except asyncio.CancelledError:
+                pass
+        if getattr(app.state, "http_client", None):
+            await app.state.http_client.aclose()
+        shutdown_password_executor()
+        close_pool()
         print("Shutdown completed")
 
 app = FastAPI(lifespan=lifespan)
 
 class SensorData(BaseModel):
-    mac_address: str
-    value: float
-    unit: str
-    timestamp: str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # Bounds match the temperature table, so a reading that validates can be inserted
+    mac_address: str = Field(min_length=1, max_length=20)
+    value: float = Field(allow_inf_nan=False, ge=-3.4e38, le=3.4e38)  # MySQL FLOAT range
+    unit: str = Field(max_length=10)
+    timestamp: str = Field(default_factory=lambda: datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    @field_validator("timestamp")
+    @classmethod
+    def normalize_timestamp(cls, value: str) -> str:
+        """Accept ISO 8601 / MySQL datetimes and store them as local 'YYYY-MM-DD HH:MM:SS'."""
+        try:
+            parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError("timestamp must be a datetime like 'YYYY-MM-DD HH:MM:SS'")
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone().replace(tzinfo=None)
+        if parsed.year < 1000:
+            raise ValueError("timestamp is out of range")
+        return parsed.strftime("%Y-%m-%d %H:%M:%S")
 
 class RegDevice(BaseModel):
     mac_address: str
@@ -100,18 +240,35 @@ class Image(BaseModel):
     height: int = 512
 
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
+app.mount("/assets", AssetFiles(directory=ASSET_DIR, check_dir=False), name="assets")
+
+
+async def get_current_user(request: Request) -> Optional[dict]:
+    """Resolve the session cookie to the logged-in user, or None."""
+    session_id = request.cookies.get("session_id")
+    if not session_id:
+        return None
+    return await get_session_user(session_id)
+
+
+async def require_user(user: Optional[dict] = Depends(get_current_user)) -> dict:
+    """Same as get_current_user, but rejects anonymous requests with a 401."""
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return user
+
 
-def read_html(file_path: str) -> str:
-    with open(file_path, "r") as f:
-        return f.read()
+def html_page(request: Request, page: str) -> Response:
+    """Serve one of the static HTML pages from the page cache."""
+    return page_cache.response(request, f"app/static/{page}.html")
 
 @app.get("/", response_class=HTMLResponse)
-def home_html():
-    return HTMLResponse(content=read_html("app/static/homepage.html"))
+def home_html(request: Request):
+    return html_page(request, "homepage")
 
 @app.get("/signup", response_class=HTMLResponse)
 def signup_html(request: Request):
-    return HTMLResponse(content=read_html("app/static/signup.html"))
+    return html_page(request, "signup")
 
 @app.post("/signup") 
 async def signup(request: Request):
@@ -127,7 +284,7 @@ async def signup(request: Request):
     if not (name and email and password and location):
         return {"error": "All fields are required"}
 
-    hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode() # hash password before storing
+    hashed_password = await hash_password(password) # hash password before storing
     try:
         user_id = await add_user(name, email, hashed_password, location)
 
@@ -152,17 +309,11 @@ async def signup(request: Request):
 
 
 @app.get("/login", response_class=HTMLResponse)
-async def login_html(request: Request):
+async def login_html(request: Request, user: Optional[dict] = Depends(get_current_user)):
     """Show login if not logged in, or redirect to profile page"""
-    session_id = request.cookies.get("session_id")
-
-    if session_id:
-        session = await get_session(session_id)
-        if session:
-            user = await get_user_by_id(session["user_id"])
-            if user:
-                return RedirectResponse(url="/dashboard", status_code=302)
-    return HTMLResponse(content=read_html("app/static/login.html"))
+    if user:
+        return RedirectResponse(url="/dashboard", status_code=302)
+    return html_page(request, "login")
 
 
 @app.post("/login")
@@ -174,7 +325,7 @@ async def login(request: Request):
 
     user = await get_user_by_email(email)
 
-    if not user or not bcrypt.checkpw(password.encode(), user["password"].encode('utf-8')):
+    if not user or not await verify_password(password, user["password"]):
         raise HTTPException(status_code=401, detail="Invalid email or password") # checks if email and hashed password match
 
     # Generate session ID and store it
@@ -191,9 +342,21 @@ async def login(request: Request):
         secure=True,  # Send only over HTTPS
     )
 
+    # Upgrade hashes made with an old cost factor, after the response is sent
+    if needs_rehash(user["password"]):
+        response.background = BackgroundTask(rehash_password, user["user_id"], password)
+
     return response
 
 
+async def rehash_password(user_id: int, password: str):
+    """Store a new hash of a just-verified password using the current cost factor."""
+    try:
+        await update_user_password(user_id, await hash_password(password))
+    except Exception as e:
+        print(f"Failed to rehash password for user {user_id}: {e}")
+
+
 @app.post("/logout")
 async def logout(request: Request):
     """Clear session and redirect to login page"""
@@ -209,30 +372,16 @@ async def logout(request: Request):
 
 
 @app.get("/wardrobe", response_class=HTMLResponse)
-async def user_wardrobe(request: Request):
+async def user_wardrobe(request: Request, user: Optional[dict] = Depends(get_current_user)):
     """Show user profile if authenticated, error if not"""
-    session_id = request.cookies.get("session_id")
-
-    if not session_id:
-        return RedirectResponse(url="/login", status_code=302)
-    
-    session = await get_session(session_id)
-    if not session:
-        return RedirectResponse(url="/login", status_code=302)
-    
-    user_id = session["user_id"]
-    if not user_id:
-        return RedirectResponse(url="/login", status_code=302)
-        
-    user = await get_user_by_id(user_id)
     if not user:
-        return {"error": "User not found"}
+        return RedirectResponse(url="/login", status_code=302)
 
-    return HTMLResponse(content=read_html("app/static/wardrobe.html"))
+    return html_page(request, "wardrobe")
 
 
 @app.post("/wardrobe/add")
-async def add_to_wardrobe(request: Request):
+async def add_to_wardrobe(request: Request, user: dict = Depends(require_user)):
 
     # get form data
     form_data = await request.form()
@@ -240,137 +389,128 @@ async def add_to_wardrobe(request: Request):
     color = form_data.get("color")
     name = form_data.get("name")
 
-    session_id = request.cookies.get("session_id")
-
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    session = await get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user_id = session["user_id"]
+    user_id = user["user_id"]
     if not name:
         name = color + ' ' + type
 
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
     await add_clothes(name, user_id, type, color)
+    invalidate_outfits(user_id)
 
     return RedirectResponse(url="/wardrobe", status_code=303)
 
 
 @app.delete("/api/wardrobe/remove")
-async def remove_from_wardrobe(clothes: Clothes, request: Request):
-    session_id = request.cookies.get("session_id")
-
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    session = await get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user_id = session["user_id"]
-
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+async def remove_from_wardrobe(clothes: Clothes, user: dict = Depends(require_user)):
+    user_id = user["user_id"]
 
     await remove_clothes(clothes.id, user_id)
+    invalidate_outfits(user_id)
     return {"success": True, "message": "Clothing item removed successfully"}
 
 
 
 @app.post("/api/wardrobe/update")
-async def update_user_clothes(clothes: Clothes, request: Request):
-    session_id = request.cookies.get("session_id")
+async def update_user_clothes(clothes: Clothes, user: dict = Depends(require_user)):
+    user_id = user["user_id"]
 
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    session = await get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user_id = session["user_id"]
-
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    await update_clothes(clothes.id, clothes.name, clothes.clothes_type, clothes.color)
+    await update_clothes(clothes.id, clothes.name, clothes.clothes_type, clothes.color, user_id)
+    invalidate_outfits(user_id)
     return {"success":f"updated clothing {clothes.id}"}
 
 
 @app.get("/api/generate-outfit/{temperature}/{condition}")
-async def generate_user_outfit(temperature: int, condition: str, request: Request):
-    session_id = request.cookies.get("session_id")
-    if session_id:
-        session = await get_session(session_id)
-        if session:
-            user_id = session["user_id"]
-            user = await get_user_by_id(user_id)
-            if user:
-                clothes = await get_user_clothes(user_id)
-                weather_text = f"{temperature}°F, {condition}"
-                prompt = f"From these pieces of clothing: {clothes} and based on the weather ({weather_text} F), generate an outfit me to wear."
-                outfit = await generate_ai_response(prompt)
-                return JSONResponse(outfit, status_code=200)
+async def generate_user_outfit(temperature: int, condition: str,
+                               user: Optional[dict] = Depends(get_current_user)):
+    if user:
+        clothes = await get_user_clothes(user["user_id"])
+        key = outfit_cache_key(user["user_id"], clothes, temperature, condition)
+        outfit = outfit_cache.get(key)
+        if outfit is None and outfit_disk_cache:
+            outfit = await asyncio.to_thread(outfit_disk_cache.get, key)
+            if outfit is not None:
+                outfit_cache.set(key, outfit)
+        if outfit is not None:
+            return JSONResponse(outfit, status_code=200, headers={"X-Cache": "hit"})
+
+        weather_text = f"{temperature}°F, {condition}"
+        prompt = f"From these pieces of clothing: {clothes} and based on the weather ({weather_text} F), generate an outfit me to wear."
+        outfit = await generate_ai_response(prompt)
+        if "error" not in outfit:
+            outfit_cache.set(key, outfit)
+            if outfit_disk_cache:
+                await asyncio.to_thread(outfit_disk_cache.set, key, outfit)
+        return JSONResponse(outfit, status_code=200, headers={"X-Cache": "miss"})
     return JSONResponse({"error": "Failed to authenticate user"}, status_code=401)
 
 
-@app.get("/api/wardrobe")
-async def get_wardrobe(request: Request):
-    """Get wardrobe data"""
-    connection = get_db_connection()
-    cursor = connection.cursor()
+def outfit_cache_key(user_id: int, clothes: list, temperature: int, condition: str) -> tuple:
+    """
+    Cache key for a generated outfit. Item ids are left out of the wardrobe
+    hash so only the actual contents matter, and nearby temperatures share
+    a bucket.
+    """
+    items = sorted((item["name"], item["type"], item["color"]) for item in clothes)
+    wardrobe_hash = hashlib.sha256(json.dumps(items).encode()).hexdigest()
+    return (user_id, wardrobe_hash, temperature // OUTFIT_TEMP_BUCKET, " ".join(condition.lower().split()))
 
-    session_id = request.cookies.get("session_id")
 
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    session = await get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user_id = session["user_id"]
-    
-    wardrobe_data = await get_user_clothes(user_id)
+def invalidate_outfits(user_id: int):
+    """Forget cached outfits after the user's wardrobe changes."""
+    # Disk entries need no cleanup: the new wardrobe hash never matches them
+    outfit_cache.discard_where(lambda key, _: key[0] == user_id)
+
 
-    return JSONResponse(wardrobe_data, status_code=200)
+@app.get("/api/wardrobe")
+async def get_wardrobe(request: Request, user: dict = Depends(require_user)):
+    """
+    Get wardrobe data. The ETag comes from the user's wardrobe version,
+    read fresh on every request (a primary key lookup), so an unchanged
+    wardrobe is answered with a 304 without loading the clothes.
+    """
+    user_id = user["user_id"]
+    version = await get_wardrobe_version(user_id)
+    etag = f'"wardrobe-{user_id}-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    body = wardrobe_cache.get((user_id, version))
+    if body is None:
+        wardrobe_data = await get_user_clothes(user_id)
+        body = json.dumps(wardrobe_data).encode()
+        wardrobe_cache.set((user_id, version), body)
+
+    return Response(body, status_code=200, media_type="application/json", headers=headers)
 
 
 @app.post("/api/chatbot-response")
-async def ai_response(prompt: Prompt, request: Request):
+async def ai_response(prompt: Prompt, user: dict = Depends(require_user)):
     """Send an async request to AI API to generate response"""
-    session_id = request.cookies.get("session_id")
-    if session_id:
-        session = await get_session(session_id)
-        if session:
-            user_id = session["user_id"]
-            user = await get_user_by_id(user_id)
-            if user:
-                response_data = await generate_ai_response(prompt.text)
-                return JSONResponse(response_data, status_code=200)
-    raise HTTPException(status_code=401, detail="Not authenticated")
+    response_data = await generate_ai_response(prompt.text)
+    return JSONResponse(response_data, status_code=200)
 
 
 async def generate_ai_response(prompt: str):
     """Send an async request to AI API to generate outfit"""
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            ai_response = await client.post(
-                AI_API_URL,
-                headers={
-                    "email": email,
-                    "pid": PID,
-                    "Content-Type": "application/json"
-                },
-                json={"prompt": prompt}
-            )
-        except httpx.TimeoutException:
-            return {"error": "AI API request timed out"} 
+    return await ai_flights.do(("response", prompt), _generate_ai_response, prompt)
+
+
+async def _generate_ai_response(prompt: str):
+    client = app.state.http_client
+    try:
+        ai_response = await client.post(
+            AI_API_URL,
+            headers={
+                "email": email,
+                "pid": PID,
+                "Content-Type": "application/json"
+            },
+            json={"prompt": prompt},
+            timeout=AI_TEXT_TIMEOUT
+        )
+    except httpx.TimeoutException:
+        client.metrics.record_failure(AI_API_URL)
+        return {"error": "AI API request timed out"} 
     response_data = ai_response.json()
 
     if ai_response.status_code != 200 or not response_data.get("success", False):
@@ -381,107 +521,102 @@ async def generate_ai_response(prompt: str):
     return {"response": ai_response}
 
 @app.post("/api/image")
-async def generate_image(image: Image, request: Request):
-    session_id = request.cookies.get("session_id")
-    if session_id:
-        session = await get_session(session_id)
-        if session:
-            user_id = session["user_id"]
-            user = await get_user_by_id(user_id)
-            if user:
-                response_data = await generate_ai_image(image.prompt, image.width, image.height)
-                return JSONResponse(response_data, status_code=200)
-    raise HTTPException(status_code=401, detail="Not authenticated")
+async def generate_image(image: Image, request: Request, user: dict = Depends(require_user)):
+    """Generate an image and return its bytes (also available at /api/image/<name>)."""
+    response_data = await generate_ai_image(image.prompt, image.width, image.height)
+    if "error" in response_data:
+        return JSONResponse(response_data, status_code=502)
+    return await image_response(request, response_data["image"])
+
+
+@app.get("/api/image/{name}")
+async def get_image(name: str, request: Request, user: dict = Depends(require_user)):
+    """Serve a previously generated image from the disk cache."""
+    return await image_response(request, name)
+
+
+async def image_response(request: Request, name: str) -> Response:
+    """Raw image bytes with an ETag; image names are content hashes, so they never change."""
+    etag = f'"{name.partition(".")[0]}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "Content-Location": f"/api/image/{name}",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    data = await asyncio.to_thread(image_store.read, name)
+    if data is None:
+        return JSONResponse({"error": "Image not found"}, status_code=404)
+    return Response(data, media_type=content_type_of(name), headers=headers)
+
 
 async def generate_ai_image(prompt: str, width: int, height: int):
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            ai_response = await client.post(
-                AI_API_IMAGE,
-                headers={
-                    "email": email,
-                    "pid": PID,
-                    "Content-Type": "application/json"
-                },
-                json={"prompt": prompt, "width":width, "height": height}
-            )
-        except httpx.TimeoutException:
-            return {"error": "AI API request timed out"} 
-    json_response = ai_response.json()
-    bit_stream = json_response["result"]["bit_stream"]
-    ai_image = bitstream_to_base64(bit_stream)
-    return JSONResponse({"image": ai_image})
+    """Return {"image": name} of a stored image for the prompt, generating it if needed."""
+    name = await asyncio.to_thread(image_store.lookup, prompt, width, height)
+    if name:
+        return {"image": name}
+    return await ai_flights.do(("image", prompt, width, height), _generate_ai_image, prompt, width, height)
 
 
-def bitstream_to_base64(bitstream):
-    """Convert a bitstream to a Base64-encoded string."""
-    byte_data = base64.b64decode(bitstream)  # Convert bitstream to bytes
-    base64_str = base64.b64encode(byte_data).decode("utf-8")  # Encode as Base64
-    return base64_str
+async def _generate_ai_image(prompt: str, width: int, height: int):
+    client = app.state.http_client
+    try:
+        ai_response = await client.post(
+            AI_API_IMAGE,
+            headers={
+                "email": email,
+                "pid": PID,
+                "Content-Type": "application/json"
+            },
+            json={"prompt": prompt, "width":width, "height": height},
+            timeout=AI_IMAGE_TIMEOUT
+        )
+    except httpx.TimeoutException:
+        client.metrics.record_failure(AI_API_IMAGE)
+        return {"error": "AI API request timed out"} 
+    json_response = ai_response.json()
+    if ai_response.status_code != 200 or "bit_stream" not in json_response.get("result", {}):
+        return {"error": f"Failed to generate image. Status code: {ai_response.status_code}"}
+
+    # The upstream sends base64; decode it once and keep the raw bytes
+    image_bytes = base64.b64decode(json_response["result"]["bit_stream"])
+    name = await asyncio.to_thread(image_store.save, prompt, width, height, image_bytes)
+    return {"image": name}
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def user_page(request: Request):
+async def user_page(request: Request, user: Optional[dict] = Depends(get_current_user)):
     """Show user dashboard if authenticated, error if not"""
-    session_id = request.cookies.get("session_id")
-
-    if not session_id:
-        return RedirectResponse(url="/login", status_code=302)
-
-    session = await get_session(session_id)
-    if not session:
-        return RedirectResponse(url="/login", status_code=302)
-
-    user_id = session["user_id"]
-    if not user_id:
-        return RedirectResponse(url="/login", status_code=302)
-    
-    user = await get_user_by_id(user_id)
     if not user:
-        return {"error": "User not found"}
+        return RedirectResponse(url="/login", status_code=302)
 
-    return HTMLResponse(content=read_html("app/static/dashboard.html"))
+    return html_page(request, "dashboard")
     
 
 @app.get("/api/userInfo")
-async def get_user_info(request: Request):
-    session_id = request.cookies.get("session_id")
-    if session_id:
-        session = await get_session(session_id)
-        if session:
-            user = await get_user_by_id(session["user_id"])
-            if user:
-                return {"name": user["name"],
-                        "email": user["email"],
-                        "location": user["location"]}
+async def get_user_info(user: Optional[dict] = Depends(get_current_user)):
+    if user:
+        return {"name": user["name"],
+                "email": user["email"],
+                "location": user["location"]}
     return {"error": "could not get user info"}
 
 
 @app.put("/api/updateUser")
-async def update_user_info(request: Request, user_data: UpdateUserInfo):
-    session_id = request.cookies.get("session_id")
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-
-    session = await get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=401, detail="Session expired")
-
-    user_id = session["user_id"]
-    user = await get_user_by_id(user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="user not found")
+async def update_user_info(user_data: UpdateUserInfo, user: dict = Depends(require_user)):
+    user_id = user["user_id"]
 
     # Check if password update is requested
     if user_data.current_password and user_data.new_password and user_data.confirm_password:
         # Validate current password
-        if not bcrypt.checkpw(user_data.current_password.encode(), user["password"].encode()):
+        if not await verify_password(user_data.current_password, user["password"]):
             raise HTTPException(status_code=400, detail="Current password is incorrect")
 
         # Check if new passwords match and update
         if user_data.new_password != user_data.confirm_password:
             raise HTTPException(status_code=400, detail="New passwords do not match")
-        hashed_new_password = bcrypt.hashpw(user_data.new_password.encode(), bcrypt.gensalt()).decode()
+        hashed_new_password = await hash_password(user_data.new_password)
         await update_user(user_id, user_data.name, user_data.location, hashed_new_password)
     
     else:
@@ -499,6 +634,27 @@ async def get_user_location(user_id: int, request: Request):
     return {"location": location}
 
 
+@app.get("/api/weather")
+async def get_user_weather(user: dict = Depends(require_user)):
+    """Current weather at the logged-in user's location."""
+    client = app.state.http_client
+    try:
+        latitude, longitude, name = user.get("latitude"), user.get("longitude"), user.get("location_name")
+        if latitude is None or longitude is None:
+            # First lookup for this location: geocode once and keep it with the user
+            place = await weather_service.geocode(client, user["location"])
+            if place is None:
+                return JSONResponse({"error": "city not found"}, status_code=404)
+            latitude, longitude, name = place["latitude"], place["longitude"], place["name"]
+            await set_user_coordinates(user["user_id"], user["location"], latitude, longitude, name)
+
+        forecast = await weather_service.current(client, latitude, longitude)
+    except (WeatherError, httpx.HTTPError) as e:
+        return JSONResponse({"error": f"Weather lookup failed: {e}"}, status_code=502)
+
+    return {"location": name, "latitude": latitude, "longitude": longitude, **forecast}
+
+
 @app.post("/api/register_device")
 def register_device(device: RegDevice):
     """Registers an ESP32 device using its MAC address."""
@@ -534,47 +690,35 @@ def register_device(device: RegDevice):
 
 
 @app.post("/api/update_device")
-async def update_device(device: DeviceInfo, request: Request):
-    session_id = request.cookies.get("session_id")
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    session = await get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user_id = session["user_id"]
-
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+async def update_device(device: DeviceInfo, user: dict = Depends(require_user)):
     await update_user_device(device.name, device.mac_address, device.id)
     return {"success": True, "message": "device updated"}
 
 
 @app.delete("/api/remove_device")
-async def delete_device(device: DeviceInfo, request: Request):
-    session_id = request.cookies.get("session_id")
-    if not session_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    session = await get_session(session_id)
-    if not session:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    user_id = session["user_id"]
-
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Not authenticated")
+async def delete_device(device: DeviceInfo, user: dict = Depends(require_user)):
     await remove_user_device(device.id, device.mac_address)
     return {"success": True, "message": "device removed"}
 
 
 @app.get("/api/temperature/{mac_address}")
 def get_all_sensor_data(mac_address: str,
+                        response: Response,
                         order_by: str = Query(None, alias="order-by"),
                         start_date: str = Query(None, alias="start-date"),
-                        end_date: str = Query(None, alias="end-date")):
+                        end_date: str = Query(None, alias="end-date"),
+                        since_id: int = Query(None, alias="since-id"),
+                        after: str = Query(None),
+                        before_id: int = Query(None, alias="before-id"),
+                        limit: int = Query(None, ge=1, le=MAX_PAGE_SIZE)):
+    """
+    Return readings for a device, oldest first.
 
+    Polling clients pass since-id (the last id they have seen) or after
+    (a timestamp) to fetch only newer rows. History browsing passes limit
+    and then before-id to page backwards with a keyset cursor. The cursor
+    for the next page comes back in the X-Next-Cursor header.
+    """
     query = f"SELECT * FROM temperature"
     condition = ["mac_address = %s"]
     params = [mac_address]
@@ -585,17 +729,46 @@ def get_all_sensor_data(mac_address: str,
     if end_date:
         condition.append("timestamp <= %s")
         params.append(end_date)
+    if since_id is not None:
+        condition.append("id > %s")
+        params.append(since_id)
+    if after:
+        condition.append("timestamp > %s")
+        params.append(after)
+    if before_id is not None:
+        condition.append("id < %s")
+        params.append(before_id)
     if condition:
         query += " WHERE " + " AND ".join(condition)
-    if order_by in {"value", "timestamp"}:
+
+    # Keyset pages walk backwards from the newest row (or before-id);
+    # incremental polls walk forwards from since-id / after.
+    newest_first = before_id is not None or (limit and since_id is None and not after)
+    if newest_first:
+        query += " ORDER BY id DESC"
+    elif since_id is not None or after:
+        query += " ORDER BY id"
+    elif order_by in {"value", "timestamp"}:
         query += f" ORDER BY {order_by}"
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
 
     connection = get_db_connection()
     cursor = connection.cursor(dictionary=True)
-    cursor.execute(query, params)
-    results = cursor.fetchall()
-    cursor.close()
-    connection.close()
+    try:
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+    finally:
+        cursor.close()
+        connection.close()
+
+    if newest_first:
+        results.reverse()
+        if limit and len(results) == limit:
+            response.headers["X-Next-Cursor"] = f"before-id={results[0]['id']}"
+    elif results and (since_id is not None or after):
+        response.headers["X-Next-Cursor"] = f"since-id={results[-1]['id']}"
 
     for row in results:
         if isinstance(row["timestamp"], datetime):  # Check if it's a datetime object
@@ -604,6 +777,167 @@ def get_all_sensor_data(mac_address: str,
     return results
 
 
+def _purged(timestamp: float, retention_days: int) -> bool:
+    """Whether a retention policy of `retention_days` has already deleted rows from `timestamp`."""
+    return retention_days > 0 and timestamp < (datetime.now() - timedelta(days=retention_days)).timestamp()
+
+
+def _lttb_points(series: pd.DataFrame, points: int) -> list:
+    """Downsample a (timestamp, value) series for the response. CPU-bound, so it runs off the event loop."""
+    if not series.empty:
+        seconds = (series["timestamp"] - pd.Timestamp(0)).dt.total_seconds()
+        series = series.iloc[lttb(seconds.to_numpy(), series["value"].to_numpy(), points)]
+    timestamps = series["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    return [{"timestamp": ts, "value": value} for ts, value in zip(timestamps, series["value"])]
+
+
+@app.get("/api/temperature/{mac_address}/aggregate")
+async def get_aggregated_sensor_data(mac_address: str,
+                                     start_date: str = Query(None, alias="start-date"),
+                                     end_date: str = Query(None, alias="end-date"),
+                                     bucket: int = Query(None, ge=1, description="Bucket width in seconds"),
+                                     points: int = Query(500, ge=3, le=MAX_PAGE_SIZE),
+                                     method: str = Query("buckets", pattern="^(buckets|lttb)$")):
+    """
+    Return a bounded-size view of a device's readings for charting.
+
+    method=buckets groups readings into fixed-width buckets (bucket
+    seconds, or sized so the range fits in `points` buckets) and returns
+    min/max/avg/count per bucket. method=lttb returns at most `points`
+    raw readings picked with Largest-Triangle-Three-Buckets. When the
+    range holds more than LTTB_MAX_ROWS readings, or reaches back past
+    raw retention, LTTB runs over minute (or hour) rollup averages.
+
+    Minute- or hour-wide buckets are served from the rollup tables, so
+    long ranges do not scan raw readings; time the rollup job hasn't
+    reached yet is filled in from raw readings. Ranges reaching back past
+    RAW_RETENTION_DAYS always use at least minute buckets (hour buckets
+    past MINUTE_RETENTION_DAYS too), since only the rollups still hold
+    that history. The minute rollup is never used for ranges older than
+    MINUTE_RETENTION_DAYS.
+    """
+    if method == "lttb":
+        span = await get_temperature_span(mac_address, start_date, end_date)
+        if span is None:
+            return {"method": "lttb", "source": "raw", "points": []}
+        source = "raw"
+        count = await count_temperature_rows(mac_address, start_date, end_date, LTTB_MAX_ROWS + 1)
+        if count > LTTB_MAX_ROWS or _purged(span[0], RAW_RETENTION_DAYS):
+            # Too many raw rows to load (or some are gone): downsample rollup averages instead
+            if not ROLLUP_ENABLED:
+                raise HTTPException(status_code=400, detail=f"More than {LTTB_MAX_ROWS} readings in range; "
+                                                            f"narrow it or use method=buckets")
+            minutes = (span[1] - span[0]) / 60
+            minute_purged = _purged(span[0], MINUTE_RETENTION_DAYS)
+            source = "minute" if minutes <= LTTB_MAX_ROWS and not minute_purged else "hour"
+        series = await get_temperature_series(mac_address, start_date, end_date, source)
+        return {"method": "lttb", "source": source,
+                "points": await asyncio.to_thread(_lttb_points, series, points)}
+
+    span = await get_temperature_span(mac_address, start_date, end_date)
+    if span is None:
+        return {"method": "buckets", "bucket": bucket, "buckets": []}
+    seconds = span[1] - span[0] + 1
+    explicit = bucket is not None
+    if bucket is None:
+        bucket = max(1, math.ceil(seconds / points))
+    # An explicit bucket width still has to keep the response bounded
+    if bucket < math.ceil(seconds / MAX_PAGE_SIZE):
+        bucket = math.ceil(seconds / MAX_PAGE_SIZE)
+        explicit = False
+
+    # Read from the coarsest rollup whose width divides the bucket. Derived
+    # widths are rounded up to a whole rollup bucket so they can use one.
+    source = "raw"
+    if ROLLUP_ENABLED:
+        # Rows older than a table's retention period are gone; a range that
+        # reaches back that far has to be read from a coarser table
+        raw_purged = _purged(span[0], RAW_RETENTION_DAYS)
+        minute_purged = _purged(span[0], MINUTE_RETENTION_DAYS)
+        for level in ("hour", "minute"):
+            _, width = ROLLUP_LEVELS[level]
+            if level == "minute" and minute_purged:
+                continue
+            if raw_purged and (level == "minute" or minute_purged) and bucket % width:
+                bucket = math.ceil(bucket / width) * width
+            if bucket >= width and not explicit:
+                bucket = math.ceil(bucket / width) * width
+            if bucket >= width and bucket % width == 0:
+                source = level
+                break
+
+    rows = await get_temperature_buckets(mac_address, bucket, start_date, end_date, source)
+    for row in rows:
+        if isinstance(row["bucket_start"], datetime):
+            row["bucket_start"] = row["bucket_start"].strftime("%Y-%m-%d %H:%M:%S")
+        row["avg"] = float(row["avg"])
+    return {"method": "buckets", "bucket": bucket, "source": source, "buckets": rows}
+
+
+@app.get("/api/temperature/{mac_address}/export")
+def export_sensor_data(mac_address: str,
+                       format: str = Query("csv", pattern="^(csv|ndjson)$"),
+                       start_date: str = Query(None, alias="start-date"),
+                       end_date: str = Query(None, alias="end-date")):
+    """Stream a device's full history as CSV or NDJSON without loading it into memory."""
+    if not export_slot_free():
+        raise HTTPException(status_code=503, detail="Too many exports running, try again shortly",
+                            headers={"Retry-After": "30"})
+    rows = iter_temperature_rows(mac_address, start_date, end_date)
+
+    def csv_chunks():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["id", "mac_address", "value", "unit", "timestamp"])
+        yield buffer.getvalue()
+        for chunk in rows:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows((id, mac_address, value, unit, timestamp) for id, value, unit, timestamp in chunk)
+            yield buffer.getvalue()
+
+    def ndjson_chunks():
+        for chunk in rows:
+            yield "".join(
+                json.dumps({"id": id, "mac_address": mac_address, "value": value,
+                            "unit": unit, "timestamp": str(timestamp)}) + "\n"
+                for id, value, unit, timestamp in chunk
+            )
+
+    if format == "ndjson":
+        return StreamingResponse(ndjson_chunks(), media_type="application/x-ndjson")
+    return StreamingResponse(
+        csv_chunks(),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{mac_address}.csv"'},
+    )
+
+
+@app.get("/api/db/pool")
+def get_db_pool_stats():
+    """Report connection pool usage."""
+    stats = get_pool_stats()
+    if stats is None:
+        return {"error": "connection pool not initialized"}
+    return stats
+
+
+@app.get("/api/http/pool")
+def get_http_pool_stats():
+    """Report outbound HTTP connection pool usage and per-endpoint latency."""
+    stats = get_http_client_stats(getattr(app.state, "http_client", None))
+    if stats is None:
+        return {"error": "HTTP client not initialized"}
+    stats["single_flight"] = ai_flights.stats()
+    return stats
+
+
+@app.get("/api/auth/pool")
+def get_password_pool_stats():
+    """Report password hashing concurrency and queue times."""
+    return get_password_stats()
+
+
 @app.post("/api/temperature")
 async def insert_sensor_data(data: SensorData):
     try:
@@ -612,9 +946,104 @@ async def insert_sensor_data(data: SensorData):
     except Exception as e:
         return {"error": f"adding data failed: {e}"}
 
+    reading_hub.publish({"id": new_id, "mac_address": data.mac_address, "value": data.value,
+                         "unit": data.unit, "timestamp": data.timestamp})
     return {"id": new_id}
 
 
+@app.post("/api/temperature/batch")
+async def insert_sensor_data_batch(readings: List[Any]):
+    """
+    Insert many sensor readings with a single multi-row INSERT.
+
+    Each reading is validated on its own (including the column limits of
+    the temperature table), so one bad row does not reject the batch. The
+    response lists a status for every row in request order. A database
+    failure returns a 500 and nothing is inserted.
+    """
+    if len(readings) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {MAX_BATCH_SIZE} readings)")
+
+    results = [None] * len(readings)
+    valid = []  # (index, SensorData)
+    for index, reading in enumerate(readings):
+        try:
+            if not isinstance(reading, dict):
+                raise ValueError("reading must be an object")
+            valid.append((index, SensorData(**reading)))
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            results[index] = {"status": "invalid", "error": errors}
+        except ValueError as e:
+            results[index] = {"status": "invalid", "error": str(e)}
+
+    try:
+        unknown = await store_readings([data for _, data in valid])
+    except Exception as e:
+        # Rows were validated against the schema, so this is a server-side failure worth retrying
+        return JSONResponse({"error": f"adding data failed: {e}", "inserted": 0}, status_code=500)
+
+    inserted = 0
+    for index, data in valid:
+        if data.mac_address in unknown:
+            results[index] = {"status": "rejected", "error": "device not registered"}
+        else:
+            results[index] = {"status": "inserted"}
+            inserted += 1
+
+    return {"inserted": inserted, "results": results}
+
+
+async def store_readings(readings: List[SensorData]) -> set:
+    """
+    Write validated readings in one multi-row INSERT and push them to live dashboards.
+
+    Returns the MAC addresses that were skipped because the device is not registered.
+    """
+    unknown, ids = await add_temperatures(
+        [(data.mac_address, data.value, data.unit, data.timestamp) for data in readings]
+    )
+    # ids line up with the readings that were inserted, in order; dashboards
+    # use them to resume with since-id after reconnecting
+    stored = [data for data in readings if data.mac_address not in unknown]
+    for row_id, data in zip(ids, stored):
+        reading_hub.publish({"id": row_id, "mac_address": data.mac_address, "value": data.value,
+                             "unit": data.unit, "timestamp": data.timestamp})
+    return unknown
+
+
+@app.get("/api/stream/temperature")
+async def stream_sensor_data(request: Request, user: dict = Depends(require_user)):
+    """
+    Server-Sent Events stream of new readings for the user's devices.
+
+    Each reading is sent as a "reading" event with the same fields as
+    GET /api/temperature/{mac_address}. Comment lines are sent while idle
+    to keep proxies from closing the connection.
+    """
+    mac_addresses = await get_user_device_macs(user["user_id"])
+    queue = reading_hub.subscribe(mac_addresses)
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    reading = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: reading\ndata: {json.dumps(reading)}\n\n"
+        finally:
+            reading_hub.unsubscribe(queue, mac_addresses)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/api/devices/{user_id}")
 def get_user_devices(user_id: int):
     """Retrieve all devices registered to a specific user."""
@@ -696,30 +1125,16 @@ def add_device_to_user(assignment: DeviceAssignment):
 
 
 @app.get("/api/getId")
-async def get_user_id(request: Request):
-    session_id = request.cookies.get("session_id")
-    if session_id:
-        session = await get_session(session_id)
-        if session:
-            user_id = session["user_id"]
-            user = await get_user_by_id(user_id)
-            if not user or user["user_id"] != user_id:
-                return {"error": f"Not authenticated as {user['name']}"}
-            return {"user_id":user_id}    
+async def get_user_id(user: Optional[dict] = Depends(get_current_user)):
+    if user:
+        return {"user_id": user["user_id"]}
     return{"error":"Could not get user id"}
 
 
 @app.get("/profile", response_class=HTMLResponse)
-async def signup_html(request: Request):
-    session_id = request.cookies.get("session_id")
-    if session_id:
-        session = await get_session(session_id)
-        if session:
-            user_id = session["user_id"]
-            user = await get_user_by_id(user_id)
-            if not user or user["user_id"] != user_id:
-                return {"error": f"Not authenticated as {user['name']}"}
-            return HTMLResponse(content=read_html("app/static/profile.html"))
+async def profile_html(request: Request, user: Optional[dict] = Depends(get_current_user)):
+    if user:
+        return html_page(request, "profile")
     return RedirectResponse(url="/login", status_code=302)
 
 
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+from datetime import datetime
+
+from pydantic import ValidationError
+
+from .database import register_devices
+
+logger = logging.getLogger(__name__)
+
+
+class MQTTIngestor:
+    """
+    Subscribes to the sensor topic and writes readings straight to the database.
+
+    This replaces the ESP32 -> broker -> bridge -> HTTP -> API hop for
+    deployments that run with MQTT_INGEST=1. paho's network thread only
+    parses and validates messages (with the same model as
+    POST /api/temperature) and hands them to the event loop through a
+    bounded queue; a task on the loop groups them into batches of up to
+    `batch_size` (or whatever arrived within `flush_interval` seconds)
+    and stores each batch with `sink`, registering unseen devices first.
+    """
+
+    def __init__(self, loop, model, sink, broker, port, topic,
+                 batch_size=500, flush_interval=1.0, queue_size=10000):
+        self.loop = loop
+        self.model = model
+        self.sink = sink
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.stats = {"received": 0, "invalid": 0, "dropped": 0, "stored": 0, "failed": 0}
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._known = set()
+        self._client = None
+        self._task = None
+
+    def start(self):
+        # paho is only needed when in-process ingestion is enabled
+        import paho.mqtt.client as mqtt
+
+        self._client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        self._client.on_connect = self._on_connect
+        self._client.on_message = self._on_message
+        self._client.connect_async(self.broker, self.port, 60)
+        self._client.loop_start()
+        self._task = self.loop.create_task(self._consume())
+        logger.info(f"MQTT ingestion started on {self.broker}:{self.port} {self.topic}")
+
+    async def stop(self):
+        if self._client:
+            self._client.disconnect()
+            self._client.loop_stop()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        # Store whatever was already received
+        if not self._queue.empty():
+            await self._store(self._drain())
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code == 0:
+            client.subscribe(self.topic, qos=1)
+            logger.info(f"Subscribed to {self.topic}")
+        else:
+            logger.error(f"MQTT connection failed with result code {reason_code}")
+
+    def _on_message(self, client, userdata, message):
+        """Runs on paho's thread: parse, validate and hand off to the event loop."""
+        self.stats["received"] += 1
+        try:
+            payload = json.loads(message.payload.decode())
+            reading = self.model(
+                mac_address=payload["mac_address"],
+                value=payload["temperature"],
+                unit="Celsius",
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            )
+            if not reading.mac_address:
+                raise ValueError("missing mac_address")
+        except (ValueError, KeyError, TypeError, ValidationError) as e:
+            self.stats["invalid"] += 1
+            logger.warning(f"Ignoring invalid message on {message.topic}: {e}")
+            return
+        self.loop.call_soon_threadsafe(self._enqueue, reading)
+
+    def _enqueue(self, reading):
+        try:
+            self._queue.put_nowait(reading)
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    def _drain(self):
+        batch = []
+        while not self._queue.empty() and len(batch) < self.batch_size:
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _consume(self):
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self.loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - self.loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._store(batch)
+
+    async def _store(self, batch):
+        try:
+            new_macs = {reading.mac_address for reading in batch} - self._known
+            if new_macs:
+                await register_devices(sorted(new_macs))
+                self._known |= new_macs
+            unknown = await self.sink(batch)
+            self.stats["stored"] += len(batch) - sum(reading.mac_address in unknown for reading in batch)
+            # Devices removed on the server get registered again next time
+            self._known -= unknown
+        except Exception as e:
+            self.stats["failed"] += len(batch)
+            logger.error(f"Failed to store MQTT readings: {e}")
@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import os
+import threading
+import time
+from typing import Callable, Dict, NamedTuple, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+
+class Page(NamedTuple):
+    mtime: float
+    etag: str
+    variants: Dict[str, bytes]  # content-encoding ("identity", "gzip", "br") -> body
+
+
+def parse_accept_encoding(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q=") and q[2:].strip() in ("0", "0.0", "0.00", "0.000"):
+            continue
+        if name:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header (a list of tags, "*", weak or strong) matches `etag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+class PageCache:
+    """
+    In-memory cache of HTML pages with precompressed variants.
+
+    Each page is read and compressed (gzip, plus brotli when the package
+    is installed) once, and served from memory afterwards. The file's
+    mtime is checked at most every `check_interval` seconds, so edits
+    still show up without a restart but a cached hit normally costs no
+    syscalls. Every encoding gets its own strong ETag, and matching
+    If-None-Match requests get a 304. `transform`, if given, is applied
+    to the file contents before caching.
+    """
+
+    def __init__(self, check_interval: float = 1.0, transform: Optional[Callable[[bytes], bytes]] = None):
+        self.check_interval = check_interval
+        self.transform = transform
+        self._pages: Dict[str, Page] = {}
+        self._checked_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _load(self, path: str) -> Page:
+        mtime = os.path.getmtime(path)
+        with open(path, "rb") as f:
+            body = f.read()
+        if self.transform:
+            body = self.transform(body)
+        variants = {"identity": body, "gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(body, quality=11)
+        etag = hashlib.sha256(body).hexdigest()[:32]
+        return Page(mtime, etag, variants)
+
+    def preload(self, *paths: str):
+        for path in paths:
+            self.get(path)
+
+    def get(self, path: str) -> Page:
+        now = time.monotonic()
+        page = self._pages.get(path)
+        if page is not None and now - self._checked_at.get(path, 0) < self.check_interval:
+            return page
+        with self._lock:
+            self._checked_at[path] = now
+            page = self._pages.get(path)
+            if page is None or os.path.getmtime(path) != page.mtime:
+                page = self._pages[path] = self._load(path)
+        return page
+
+    def response(self, request: Request, path: str) -> Response:
+        page = self.get(path)
+        accepted = parse_accept_encoding(request.headers.get("accept-encoding", ""))
+        encoding = next((name for name in ("br", "gzip") if name in accepted and name in page.variants), "identity")
+
+        etag = f'"{page.etag}"' if encoding == "identity" else f'"{page.etag}-{encoding}"'
+        headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+        if encoding != "identity":
+            headers["Content-Encoding"] = encoding
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(page.variants[encoding], media_type="text/html; charset=utf-8", headers=headers)
+
+    def stats(self) -> dict:
+        return {path: {"etag": page.etag, "sizes": {k: len(v) for k, v in page.variants.items()}}
+                for path, page in self._pages.items()}
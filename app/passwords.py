@@ -0,0 +1,104 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+
+_executor: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_stats = {"calls": 0, "pending": 0, "queue_ms_total": 0.0, "queue_ms_max": 0.0,
+          "run_ms_total": 0.0, "run_ms_max": 0.0}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """
+    Thread pool for bcrypt work.
+
+    bcrypt releases the GIL while hashing, so threads run in parallel,
+    and keeping them off the event loop means a burst of logins doesn't
+    stall every other request. PASSWORD_WORKERS caps how many hashes run
+    at once; the rest wait in the executor queue.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+async def _run(func, *args):
+    submitted_at = time.perf_counter()
+    with _lock:
+        _stats["pending"] += 1
+
+    def timed():
+        started_at = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            finished_at = time.perf_counter()
+            queue_ms = (started_at - submitted_at) * 1000
+            run_ms = (finished_at - started_at) * 1000
+            with _lock:
+                _stats["pending"] -= 1
+                _stats["calls"] += 1
+                _stats["queue_ms_total"] += queue_ms
+                _stats["queue_ms_max"] = max(_stats["queue_ms_max"], queue_ms)
+                _stats["run_ms_total"] += run_ms
+                _stats["run_ms_max"] = max(_stats["run_ms_max"], run_ms)
+
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), timed)
+
+
+def _hash(password: str) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
+
+
+def _verify(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password with the configured cost factor."""
+    return await _run(_hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await _run(_verify, password, hashed)
+
+
+def needs_rehash(hashed: str) -> bool:
+    """Whether a stored hash was made with a different cost than BCRYPT_ROUNDS."""
+    # bcrypt hashes look like $2b$<cost>$<salt+hash>
+    parts = hashed.split("$")
+    try:
+        return int(parts[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return False
+
+
+def get_password_stats() -> dict:
+    with _lock:
+        calls = _stats["calls"]
+        return {
+            "workers": PASSWORD_WORKERS,
+            "rounds": BCRYPT_ROUNDS,
+            "calls": calls,
+            "pending": _stats["pending"],
+            "avg_queue_ms": round(_stats["queue_ms_total"] / calls, 1) if calls else None,
+            "max_queue_ms": round(_stats["queue_ms_max"], 1),
+            "avg_run_ms": round(_stats["run_ms_total"] / calls, 1) if calls else None,
+            "max_run_ms": round(_stats["run_ms_max"], 1),
+        }
@@ -0,0 +1,54 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+
+from .database import run_temperature_rollup, purge_temperature_batch
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_INTERVAL = float(os.getenv("ROLLUP_INTERVAL", "60"))  # seconds between runs
+# Opt-in: deleting raw readings is irreversible, only the rollups remain afterwards
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", "0"))  # 0 keeps raw readings forever
+# Also opt-in: purging minute rollups while raw readings are kept only makes old ranges slower to read
+MINUTE_RETENTION_DAYS = int(os.getenv("MINUTE_RETENTION_DAYS", "0"))  # 0 keeps minute rollups forever
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.5"))  # seconds between delete batches
+
+
+async def apply_retention(table: str, days: int):
+    """Delete rows older than `days` in small batches so locks stay short."""
+    if days <= 0:
+        return 0
+    cutoff = datetime.now() - timedelta(days=days)
+    total = 0
+    while True:
+        deleted = await purge_temperature_batch(table, cutoff, RETENTION_BATCH_SIZE)
+        total += deleted
+        if deleted < RETENTION_BATCH_SIZE:
+            break
+        await asyncio.sleep(RETENTION_BATCH_PAUSE)
+    if total:
+        logger.info(f"Retention removed {total} rows from {table}")
+    return total
+
+
+async def rollup_loop():
+    """Background job: keep rollups current and enforce retention."""
+    if RAW_RETENTION_DAYS > 0:
+        logger.warning(
+            f"RAW_RETENTION_DAYS={RAW_RETENTION_DAYS}: raw readings older than that are deleted once "
+            f"rolled up; only minute/hour aggregates are kept for older history"
+        )
+    while True:
+        try:
+            # Catch up on any backlog window by window before purging anything
+            while await run_temperature_rollup():
+                pass
+            await apply_retention("temperature", RAW_RETENTION_DAYS)
+            await apply_retention("temperature_minute", MINUTE_RETENTION_DAYS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Temperature rollup failed: {e}")
+        await asyncio.sleep(ROLLUP_INTERVAL)
@@ -0,0 +1,38 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one in-flight call.
+
+    The first caller for a key starts the call; callers arriving while it
+    is still running await the same task and get the same result (or
+    exception). Nothing is kept once the call finishes, so this only
+    merges requests that overlap in time. Waiters are shielded from each
+    other: a caller that gets cancelled (e.g. the client disconnected)
+    doesn't cancel the call for everyone else.
+    """
+
+    def __init__(self):
+        self._inflight = {}  # key -> asyncio.Task
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self.calls += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._inflight), "calls": self.calls, "shared": self.shared}
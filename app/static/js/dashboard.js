@@ -2,6 +2,9 @@ const sensor  = "temperature";
 var temperature;
 var condition;
 var charts = {};
+var lastIds = {}; // last reading id seen per device, used to catch up after reconnects
+var deviceIds = {}; // mac_address -> device_id for routing live readings
+const CHART_POINTS = 500;
 
 document.addEventListener("DOMContentLoaded", function(){
     const wardrobeBtn = document.getElementById("wardrobe-button");
@@ -57,6 +60,7 @@ document.addEventListener("DOMContentLoaded", function(){
                 chartContainer.innerHTML = "";
 
                 devices.forEach(device => {
+                    deviceIds[device.mac_address] = device.device_id;
                     const { device_id, name, mac_address } = device;
                     console.log(mac_address);
 
@@ -69,12 +73,11 @@ document.addEventListener("DOMContentLoaded", function(){
                     chartContainer.appendChild(chartWrapper);
 
                     fetchSensorData(mac_address, device_id);
-
-                    // Start periodic updates every 5 seconds
-                    setInterval(() => {
-                        updateChart(mac_address, device_id);
-                    }, 5000);
                 });
+
+                if (devices.length > 0) {
+                    subscribeToReadings();
+                }
             });
         })
         .catch(error => console.error("Error getting User ID:", error));
@@ -121,38 +124,23 @@ document.addEventListener("DOMContentLoaded", function(){
 
 // Function to get weather from api
 function getWeather(userId) {
-    fetch(`/api/location/${userId}`)
+    // the server geocodes the user's location and caches forecasts
+    fetch(`/api/weather`)
     .then(response => response.json())
-    .then(async data => {
-        // fetch city coordinates from OpenStreetMap
-        let geoResponse = await fetch(`https://nominatim.openstreetmap.org/search?q=${data.location}&format=json`);
-        let geoData = await geoResponse.json()
-
+    .then(weather => {
         // cgecks if valid city
-        if(geoData.length == 0){
-            alert("city not found");
+        if (weather.error) {
+            alert(weather.error);
             return;
         }
-        let lat = geoData[0].lat;
-        let lon = geoData[0].lon;
 
-        // fetch weather API from National Weather Service
-        let weatherResponse = await fetch(`https://api.weather.gov/points/${lat},${lon}`);
-        let weatherData = await weatherResponse.json();
-
-        // get forecast URL
-        const forecastUrl = weatherData.properties.forecast;
-        let forecastResponse = await fetch(forecastUrl);
-        let forecastData = await forecastResponse.json();
-
-        let weather = forecastData.properties.periods[0]; // gets current weather info
         temperature = weather.temperature
-        condition = weather.shortForecast
+        condition = weather.condition
         // updates weather results info 
-        document.getElementById("location").textContent = "Location:" + geoData[0].name;
+        document.getElementById("location").textContent = "Location:" + weather.location;
         document.getElementById("condition").textContent = "Weather Condition(s):" + condition;
-        document.getElementById("wind-speed").textContent = "Wind Speed:" + weather.windSpeed;  
-        document.getElementById("temperature").textContent = "Temperature:" + temperature + "°F";
+        document.getElementById("wind-speed").textContent = "Wind Speed:" + weather.wind_speed;  
+        document.getElementById("temperature").textContent = "Temperature:" + temperature + "°" + weather.unit;
     })
 }
 
@@ -219,11 +207,12 @@ function fetchDevices(userId) {
 }
 
 function fetchSensorData(mac_address, deviceId) {
-    fetch(`/api/temperature/${mac_address}`)
+    fetch(`/api/temperature/${mac_address}?limit=${CHART_POINTS}`)
         .then(response => response.json())
         .then(data => {
             const timestamps = data.map(entry => entry.timestamp);
             const values = data.map(entry => entry.value);
+            lastIds[deviceId] = data.length ? data[data.length - 1].id : 0;
             
             createChart(`chart-${deviceId}`, timestamps, values);
         })
@@ -268,18 +257,81 @@ function createChart(chartId, labels, data) {
     }
 }
 
+// Listen for new readings pushed by the server instead of polling
+function subscribeToReadings() {
+    const source = new EventSource("/api/stream/temperature");
+    let reconnecting = false;
+
+    source.addEventListener("reading", event => {
+        const entry = JSON.parse(event.data);
+        const deviceId = deviceIds[entry.mac_address];
+        if (deviceId === undefined) return;
+
+        // Skip readings a reconnect catch-up already drew
+        if (entry.id !== undefined && lastIds[deviceId] !== undefined && entry.id <= lastIds[deviceId]) return;
+
+        appendReadings(deviceId, [entry]);
+        if (entry.id !== undefined) {
+            lastIds[deviceId] = entry.id;
+        }
+    });
+
+    source.addEventListener("error", () => {
+        reconnecting = true; // EventSource retries on its own
+    });
+
+    source.addEventListener("open", () => {
+        // Fill in anything published while we were disconnected
+        if (reconnecting) {
+            reconnecting = false;
+            Object.entries(deviceIds).forEach(([mac_address, deviceId]) => {
+                updateChart(mac_address, deviceId);
+            });
+        }
+    });
+}
+
+function appendReadings(deviceId, data) {
+    const chart = charts[`chart-${deviceId}`];
+    if (!chart || data.length === 0) return;
+
+    data.forEach(entry => {
+        chart.data.labels.push(entry.timestamp);
+        chart.data.datasets[0].data.push(entry.value);
+    });
+
+    // Keep a sliding window so the chart doesn't grow forever
+    const extra = chart.data.labels.length - CHART_POINTS;
+    if (extra > 0) {
+        chart.data.labels.splice(0, extra);
+        chart.data.datasets[0].data.splice(0, extra);
+    }
+    chart.update();
+}
+
 function updateChart(mac_address, deviceId) {
-    fetch(`/api/temperature/${mac_address}`)
+    // Initial load hasn't finished yet
+    if (lastIds[deviceId] === undefined) return;
+
+    // Only ask for readings newer than the last one we have; the chart
+    // never shows more than CHART_POINTS, so don't fetch more than that
+    const sinceId = lastIds[deviceId];
+    fetch(`/api/temperature/${mac_address}?since-id=${sinceId}&limit=${CHART_POINTS}`)
         .then(response => response.json())
         .then(data => {
-            const timestamps = data.map(entry => entry.timestamp);
-            const values = data.map(entry => entry.value);
-
-            if (charts[`chart-${deviceId}`]) {
-                charts[`chart-${deviceId}`].data.labels = timestamps;
-                charts[`chart-${deviceId}`].data.datasets[0].data = values;
-                charts[`chart-${deviceId}`].update();
+            // A full page means we missed more than the chart holds, and
+            // it's the oldest part of the gap; reload the latest window
+            if (data.length === CHART_POINTS) {
+                fetchSensorData(mac_address, deviceId);
+                return;
             }
+
+            // Live events may have moved past sinceId while this was in flight
+            data = data.filter(entry => entry.id > lastIds[deviceId]);
+            if (data.length === 0) return;
+
+            lastIds[deviceId] = data[data.length - 1].id;
+            appendReadings(deviceId, data);
         })
         .catch(error => console.error(`Error updating chart for ${mac_address}:`, error));
 }
\ No newline at end of file
@@ -0,0 +1,124 @@
+import os
+from typing import Optional
+
+import httpx
+
+from .cache import TTLCache
+from .singleflight import SingleFlight
+
+GEOCODE_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+WEATHER_TIMEOUT = httpx.Timeout(15.0, connect=5.0)
+
+
+class WeatherError(Exception):
+    """An upstream weather or geocoding service failed or answered with nonsense."""
+
+
+class NWSUpstream:
+    """
+    Geocoding through Nominatim and forecasts from the National Weather Service.
+
+    Base URLs are parameters so a local stand-in can replace either
+    service (e.g. in tests, via WEATHER_GEOCODE_URL / WEATHER_API_URL).
+    Both services ask clients to identify themselves with a User-Agent.
+    """
+
+    def __init__(self, geocode_url: str = "https://nominatim.openstreetmap.org",
+                 weather_url: str = "https://api.weather.gov", user_agent: str = "smart-wardrobe"):
+        self.geocode_url = geocode_url.rstrip("/")
+        self.weather_url = weather_url.rstrip("/")
+        self.headers = {"User-Agent": user_agent, "Accept": "application/geo+json, application/json"}
+
+    async def _get_json(self, client: httpx.AsyncClient, url: str, timeout: httpx.Timeout, **params):
+        response = await client.get(url, params=params or None, headers=self.headers, timeout=timeout)
+        if response.status_code != 200:
+            raise WeatherError(f"{url} returned {response.status_code}")
+        return response.json()
+
+    async def geocode(self, client: httpx.AsyncClient, query: str) -> Optional[dict]:
+        """Coordinates and display name for a free-text location, or None if unknown."""
+        results = await self._get_json(client, f"{self.geocode_url}/search", GEOCODE_TIMEOUT,
+                                       q=query, format="json", limit=1)
+        if not results:
+            return None
+        return {"latitude": float(results[0]["lat"]), "longitude": float(results[0]["lon"]),
+                "name": results[0].get("name") or results[0].get("display_name") or query}
+
+    async def grid_point(self, client: httpx.AsyncClient, latitude: float, longitude: float) -> dict:
+        """The forecast grid cell covering a coordinate."""
+        data = await self._get_json(client, f"{self.weather_url}/points/{latitude},{longitude}", WEATHER_TIMEOUT)
+        try:
+            properties = data["properties"]
+            return {
+                "grid": f"{properties['gridId']}/{properties['gridX']},{properties['gridY']}",
+                "forecast_url": properties["forecast"],
+            }
+        except (KeyError, TypeError):
+            raise WeatherError(f"No forecast grid for {latitude},{longitude}")
+
+    async def forecast(self, client: httpx.AsyncClient, point: dict) -> dict:
+        """Current forecast period for a grid cell."""
+        data = await self._get_json(client, point["forecast_url"], WEATHER_TIMEOUT)
+        try:
+            period = data["properties"]["periods"][0]
+        except (KeyError, IndexError, TypeError):
+            raise WeatherError(f"Empty forecast for {point['grid']}")
+        return {
+            "temperature": period["temperature"],
+            "unit": period.get("temperatureUnit", "F"),
+            "condition": period["shortForecast"],
+            "wind_speed": period.get("windSpeed"),
+        }
+
+
+class WeatherService:
+    """
+    Caching front for a weather upstream.
+
+    Coordinates map to forecast grid cells (cached for a day, they don't
+    move), and forecasts are cached per grid cell for `forecast_ttl`
+    seconds, so every user in the same area shares one upstream fetch.
+    Concurrent misses for the same key are coalesced.
+    """
+
+    def __init__(self, upstream, forecast_ttl: float = 600.0, point_ttl: float = 86400.0):
+        self.upstream = upstream
+        self.points = TTLCache(maxsize=10000, ttl=point_ttl)
+        self.forecasts = TTLCache(maxsize=10000, ttl=forecast_ttl)
+        self.flights = SingleFlight()
+
+    async def geocode(self, client: httpx.AsyncClient, location: str) -> Optional[dict]:
+        return await self.flights.do(("geocode", location), self.upstream.geocode, client, location)
+
+    async def current(self, client: httpx.AsyncClient, latitude: float, longitude: float) -> dict:
+        # weather.gov only accepts 4 decimal places
+        key = (round(latitude, 4), round(longitude, 4))
+        point = self.points.get(key)
+        if point is None:
+            point = await self.flights.do(("point", key), self._fetch_point, client, key)
+        forecast = self.forecasts.get(point["grid"])
+        if forecast is None:
+            forecast = await self.flights.do(("forecast", point["grid"]), self._fetch_forecast, client, point)
+        return forecast
+
+    async def _fetch_point(self, client: httpx.AsyncClient, key: tuple) -> dict:
+        point = await self.upstream.grid_point(client, *key)
+        self.points.set(key, point)
+        return point
+
+    async def _fetch_forecast(self, client: httpx.AsyncClient, point: dict) -> dict:
+        forecast = await self.upstream.forecast(client, point)
+        self.forecasts.set(point["grid"], forecast)
+        return forecast
+
+    def stats(self) -> dict:
+        return {"points": self.points.stats(), "forecasts": self.forecasts.stats(), "single_flight": self.flights.stats()}
+
+
+def create_weather_service() -> WeatherService:
+    upstream = NWSUpstream(
+        geocode_url=os.getenv("WEATHER_GEOCODE_URL", "https://nominatim.openstreetmap.org"),
+        weather_url=os.getenv("WEATHER_API_URL", "https://api.weather.gov"),
+        user_agent=os.getenv("WEATHER_USER_AGENT", "smart-wardrobe (ece140)"),
+    )
+    return WeatherService(upstream, forecast_ttl=float(os.getenv("WEATHER_FORECAST_TTL", "600")))
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+from app import database
+
+
+QUERY_SECONDS = 0.2
+CONCURRENT_CALLS = 10
+MAX_LOOP_LAG = 0.05
+
+
+class SlowCursor:
+    """Cursor whose queries block the calling thread like a real round trip."""
+
+    def execute(self, query, params=None):
+        time.sleep(QUERY_SECONDS)
+
+    def fetchone(self):
+        return {"user_id": 1, "email": "a@example.com"}
+
+    def close(self):
+        pass
+
+
+class SlowConnection:
+    def cursor(self, *args, **kwargs):
+        return SlowCursor()
+
+    def close(self):
+        pass
+
+
+def test_blocking_queries_do_not_stall_event_loop(monkeypatch):
+    monkeypatch.setattr(database, "get_db_connection", SlowConnection)
+
+    async def run():
+        lags = []
+        done = asyncio.Event()
+
+        async def ticker():
+            # Measures how late each 10 ms wake-up is; a blocked loop shows up as lag
+            while not done.is_set():
+                expected = time.perf_counter() + 0.01
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - expected)
+
+        tick_task = asyncio.create_task(ticker())
+        started = time.perf_counter()
+        users = await asyncio.gather(
+            *(database.get_user_by_email("a@example.com") for _ in range(CONCURRENT_CALLS))
+        )
+        elapsed = time.perf_counter() - started
+        done.set()
+        await tick_task
+        return users, elapsed, lags
+
+    try:
+        users, elapsed, lags = asyncio.run(run())
+    finally:
+        database.close_pool()
+
+    assert all(user["user_id"] == 1 for user in users)
+    # Queries ran in parallel on the executor instead of one after another
+    assert elapsed < QUERY_SECONDS * CONCURRENT_CALLS / 2
+    assert lags and max(lags) < MAX_LOOP_LAG